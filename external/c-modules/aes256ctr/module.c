@@ -64,18 +64,8 @@ is_unaligned(const void *p)
     return !!(((uint32_t)p) & 0x3);
 }
 
-STATIC mp_obj_t s_AES256CTR_cipher(mp_obj_t self_in, mp_obj_t buf_in)
+STATIC void do_cipher(mp_obj_AES256CTR_t *self, const uint8_t *inp, uint8_t *outp, int in_len)
 {
-    mp_obj_AES256CTR_t *self = MP_OBJ_TO_PTR(self_in);
-
-    mp_buffer_info_t buf;
-    mp_get_buffer_raise(buf_in, &buf, MP_BUFFER_READ);
-
-    int len = buf.len, in_len = buf.len;
-    const uint8_t *inp = buf.buf;
-    uint8_t *rv = m_malloc(in_len);
-    uint8_t *outp = rv;
-
     if(self->runt_len) {
         // we've already encrypted (w/ zero bytes) for this part
         uint8_t *ch = &self->runt[BLKSIZE - self->runt_len];
@@ -86,7 +76,8 @@ STATIC mp_obj_t s_AES256CTR_cipher(mp_obj_t self_in, mp_obj_t buf_in)
         }
     }
 
-    bool nogood = (is_unaligned(inp) || is_unaligned(outp));
+    // in-place also goes thru a temp block, so ASM never sees overlapping in/out
+    bool nogood = (is_unaligned(inp) || is_unaligned(outp) || (inp == outp));
 
     while(in_len) {
         if(in_len >= BLKSIZE) {
@@ -123,11 +114,37 @@ STATIC mp_obj_t s_AES256CTR_cipher(mp_obj_t self_in, mp_obj_t buf_in)
             ctr--;
         }
     }
+}
+
+STATIC mp_obj_t s_AES256CTR_cipher(mp_obj_t self_in, mp_obj_t buf_in)
+{
+    mp_obj_AES256CTR_t *self = MP_OBJ_TO_PTR(self_in);
 
-    return mp_obj_new_bytearray_by_ref(len, rv);
+    mp_buffer_info_t buf;
+    mp_get_buffer_raise(buf_in, &buf, MP_BUFFER_READ);
+
+    uint8_t *rv = m_malloc(buf.len);
+
+    do_cipher(self, buf.buf, rv, buf.len);
+
+    return mp_obj_new_bytearray_by_ref(buf.len, rv);
 }
 STATIC MP_DEFINE_CONST_FUN_OBJ_2(s_AES256CTR_cipher_obj, s_AES256CTR_cipher);
 
+STATIC mp_obj_t s_AES256CTR_cipher_inplace(mp_obj_t self_in, mp_obj_t buf_in)
+{
+    // same as cipher(), but overwrites the (writable) buffer given; no allocation
+    mp_obj_AES256CTR_t *self = MP_OBJ_TO_PTR(self_in);
+
+    mp_buffer_info_t buf;
+    mp_get_buffer_raise(buf_in, &buf, MP_BUFFER_RW);
+
+    do_cipher(self, buf.buf, buf.buf, buf.len);
+
+    return mp_const_none;
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_2(s_AES256CTR_cipher_inplace_obj, s_AES256CTR_cipher_inplace);
+
 STATIC mp_obj_t s_AES256CTR_copy(mp_obj_t self_in) {
     mp_obj_AES256CTR_t *self = MP_OBJ_TO_PTR(self_in);
 
@@ -154,6 +171,7 @@ STATIC MP_DEFINE_CONST_FUN_OBJ_1(s_AES256CTR_blank_obj, s_AES256CTR_blank);
 
 STATIC const mp_rom_map_elem_t s_AES256CTR_locals_dict_table[] = {
     { MP_ROM_QSTR(MP_QSTR_cipher), MP_ROM_PTR(&s_AES256CTR_cipher_obj) },
+    { MP_ROM_QSTR(MP_QSTR_cipher_inplace), MP_ROM_PTR(&s_AES256CTR_cipher_inplace_obj) },
     { MP_ROM_QSTR(MP_QSTR_blank), MP_ROM_PTR(&s_AES256CTR_blank_obj) },
     { MP_ROM_QSTR(MP_QSTR_blank), MP_ROM_PTR(&s_AES256CTR_blank_obj) },
     { MP_ROM_QSTR(MP_QSTR_copy), MP_ROM_PTR(&s_AES256CTR_copy_obj) },
@@ -16,6 +16,10 @@ from glob import settings
 from auth import write_sig_file
 from utils import addr_fmt_label
 
+# bulk export: most addresses in one file, and size of each write to card
+MAX_BULK_EXPORT = const(1000000)
+EXPORT_CHUNK = const(8192)
+
 def truncate_address(addr):
     # Truncates address to width of screen, replacing middle chars
     # - 16 chars screen width
@@ -264,6 +268,8 @@ Press (3) if you really understand and accept these risks.
                 export_msg += " Press (4) to save to Virtual Disk."
             if allow_change and change == 0:
                 export_msg += " Press (6) to show change addresses."  # 5 is needed to move up
+            if n > 1:
+                export_msg += " Press OK for bulk export."
             export_msg += '\n\n'
 
             msg = ""
@@ -338,6 +344,10 @@ Press (3) if you really understand and accept these risks.
                                         change=change, force_vdisk=force_vdisk)
                 # continue on same screen in case they want to write to multiple cards
 
+            elif ch == 'y' and n > 1:
+                # many addresses, from any starting point
+                await self.bulk_export(path, addr_fmt, ms_wallet, change)
+
             elif ch == '2':
                 # switch into a mode that shows them as QR codes
                 if not version.has_fatram or ms_wallet:
@@ -370,6 +380,31 @@ Press (3) if you really understand and accept these risks.
 
             msg, addrs = make_msg(change)
 
+    async def bulk_export(self, path, addr_fmt, ms_wallet, change):
+        # write a large range of addresses to file; pick a later start index to resume
+        from glob import VD
+        from ux import ux_enter_number
+
+        start = await ux_enter_number('Start index:', 0x7fffffff, can_cancel=True)
+        if start is None: return
+
+        count = await ux_enter_number('How many?', MAX_BULK_EXPORT, can_cancel=True)
+        if not count: return
+
+        count = min(count, 0x80000000 - start)
+        msg = 'Save addresses %d..%d' % (start, start + count - 1)
+        if VD:
+            ch = await ux_show_story(msg + '?\n\nPress (1) to save to SD Card, '
+                                        'or (4) to save to Virtual Disk.', escape='14')
+        else:
+            ch = await ux_show_story(msg + ' to SD Card?\n\nPress OK to continue.')
+            ch = '1' if ch == 'y' else ch
+        if ch not in '14': return
+
+        await make_address_summary_file(path, addr_fmt, ms_wallet, self.account_num,
+                                        count=count, change=change,
+                                        force_vdisk=(ch == '4'), start=start)
+
 def generate_address_csv(path, addr_fmt, ms_wallet, account_num, n, start=0, change=0):
     # Produce CSV file contents as a generator
 
@@ -391,6 +426,24 @@ def generate_address_csv(path, addr_fmt, ms_wallet, account_num, n, start=0, cha
     yield '"Index","Payment Address","Derivation"\n'
     ch = chains.current_chain()
 
+    if path.endswith('/{idx}'):
+        # work from public parent node (account and change level): one non-hardened
+        # step per address, and no secrets held while we write
+        prefix = path[:-5].format(account=account_num, change=change)
+        with stash.SensitiveValues() as sv:
+            node = sv.derive_path(prefix, register=False)
+            xpub = ch.serialize_public(node)
+            stash.blank_object(node)
+
+        parent = ch.deserialize_node(xpub, AF_CLASSIC)
+        for idx in range(start, start+n):
+            node = parent.copy()
+            node.derive(idx, False)
+
+            yield '%d,"%s","%s%d"\n' % (idx, ch.address(node, addr_fmt), prefix, idx)
+
+        return
+
     with stash.SensitiveValues() as sv:
         for idx in range(start, start+n):
             deriv = path.format(account=account_num, change=change, idx=idx)
@@ -401,40 +454,58 @@ def generate_address_csv(path, addr_fmt, ms_wallet, account_num, n, start=0, cha
         stash.blank_object(node)
 
 async def make_address_summary_file(path, addr_fmt, ms_wallet, account_num,
-                                        count=250, change=0, force_vdisk=False):
+                                        count=250, change=0, force_vdisk=False, start=0):
 
     # write addresses into a text file on the MicroSD/VirtDisk
+    # - written in big chunks; if that fails part way, says where to resume
     from glob import dis
     from files import CardSlot, CardMissingError, needs_microsd
+    import utime
 
     # simple: always set number of addresses.
     # - takes 60 seconds to write 250 addresses on actual hardware
 
-    dis.fullscreen('Saving 0-%d' % count)
-    fname_pattern='addresses.csv'
+    dis.fullscreen('Saving %d-%d' % (start, start + count - 1))
+    fname_pattern = 'addresses.csv' if not start else 'addresses-%d.csv' % start
 
     # generator function
-    body = generate_address_csv(path, addr_fmt, ms_wallet, account_num, count, change=change)
+    body = generate_address_csv(path, addr_fmt, ms_wallet, account_num, count,
+                                    start=start, change=change)
+
+    done = 0            # addresses written to card so far
+    t0 = utime.ticks_ms()
 
     # pick filename and write
     try:
         with CardSlot(force_vdisk=force_vdisk) as card:
             fname, nice = card.pick_filename(fname_pattern)
             h = sha256()
-            # do actual write
+            buf = bytearray()
+            # do actual write; first part is CSV header
             with open(fname, 'wb') as fd:
                 for idx, part in enumerate(body):
-                    ep = part.encode()
-                    fd.write(ep)
-                    if not ms_wallet:
-                        h.update(ep)
+                    buf.extend(part.encode())
+
+                    if len(buf) >= EXPORT_CHUNK:
+                        fd.write(buf)
+                        if not ms_wallet:
+                            h.update(buf)
+                        buf = bytearray()
+                        done = idx
+
+                    if idx % 25 == 0:
+                        dt = utime.ticks_diff(utime.ticks_ms(), t0) or 1
+                        dis.fullscreen('Saving...', percent=idx/count,
+                                        line2='%d of %d: %d/sec' % (idx, count, idx*1000 // dt))
 
-                    if idx % 5 == 0:
-                        dis.progress_bar_show(idx / count)
+                fd.write(buf)
+                if not ms_wallet:
+                    h.update(buf)
+                done = count
 
             sig_nice = None
             if not ms_wallet:
-                derive = path.format(account=account_num, change=change, idx=0)  # first addr
+                derive = path.format(account=account_num, change=change, idx=start)  # first addr
                 sig_nice = write_sig_file([(h.digest(), fname)], derive, addr_fmt)
 
     except CardMissingError:
@@ -442,7 +513,11 @@ async def make_address_summary_file(path, addr_fmt, ms_wallet, account_num,
         return
     except Exception as e:
         from utils import problem_file_line
-        await ux_show_story('Failed to write!\n\n\n'+str(e) + problem_file_line(e))
+        msg = 'Failed to write!\n\n\n'+str(e) + problem_file_line(e)
+        if done:
+            msg += '\n\nAddresses before index %d were written. Use that as ' \
+                    'start index of a bulk export, to resume.' % (start + done)
+        await ux_show_story(msg)
         return
 
     msg = '''Address summary file written:\n\n%s''' % nice
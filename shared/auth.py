@@ -3,14 +3,14 @@
 # Operations that require user authorization, like our core features: signing messages
 # and signing bitcoin transactions.
 #
-import stash, ure, ux, chains, sys, gc, uio, version, ngu
+import stash, ure, ux, chains, sys, gc, uio, version, ngu, utime
 from ubinascii import b2a_base64, a2b_base64
 from ubinascii import hexlify as b2a_hex
 from ubinascii import unhexlify as a2b_hex
 from public_constants import MSG_SIGNING_MAX_LENGTH, SUPPORTED_ADDR_FORMATS
 from public_constants import AFC_SCRIPT, AF_CLASSIC, AFC_BECH32, AF_P2WPKH, AF_P2WPKH_P2SH
 from public_constants import STXN_FLAGS_MASK, STXN_FINALIZE, STXN_VISUALIZE, STXN_SIGNED
-from sffile import SFFile
+from sffile import SFFile, PSRAMFile
 from ux import ux_aborted, ux_show_story, abort_and_goto, ux_dramatic_pause, ux_clear_keys
 from ux import show_qr_code
 from usb import CCBusyError
@@ -24,6 +24,16 @@ from version import has_psram, has_fatram, MAX_TXN_LEN
 TXN_INPUT_OFFSET = 0
 TXN_OUTPUT_OFFSET = MAX_TXN_LEN
 
+# Batch signing (Mk4, HSM mode): same area of PSRAM, split into slots each
+# with an input and output file, so several PSBT can be in flight at once.
+BATCH_NUM_SLOTS = const(4)
+BATCH_SLOT_LEN = const(512*1024)
+
+def batch_slot_offsets(slot):
+    # where the input and output files for a batch slot live, in PSRAM
+    assert 0 <= slot < BATCH_NUM_SLOTS, 'bad slot'
+    return (slot * BATCH_SLOT_LEN, (BATCH_NUM_SLOTS + slot) * BATCH_SLOT_LEN)
+
 class UserAuthorizedAction:
     active_request = None
 
@@ -585,9 +595,16 @@ async def verify_txt_sig_file(filename):
 
 
 class ApproveTransaction(UserAuthorizedAction):
-    def __init__(self, psbt_len, flags=0x0, approved_cb=None, psbt_sha=None):
+    def __init__(self, psbt_len, flags=0x0, approved_cb=None, psbt_sha=None, slot=None):
         super().__init__()
         self.psbt_len = psbt_len
+        self.slot = slot
+        if slot is None:
+            self.in_offset, self.out_offset = TXN_INPUT_OFFSET, TXN_OUTPUT_OFFSET
+            self.out_max = MAX_TXN_LEN
+        else:
+            self.in_offset, self.out_offset = batch_slot_offsets(slot)
+            self.out_max = BATCH_SLOT_LEN
         self.do_finalize = bool(flags & STXN_FINALIZE)
         self.do_visualize = bool(flags & STXN_VISUALIZE)
         self.stxn_flags = flags
@@ -596,6 +613,19 @@ class ApproveTransaction(UserAuthorizedAction):
         self.approved_cb = approved_cb
         self.result = None      # will be (len, sha256) of the resulting PSBT
         self.chain = chains.current_chain()
+        self.user_auth = None   # HSM: users' auth captured ahead of time, see BatchSigner
+
+    def done(self, redraw=True):
+        from multisig import MultisigWallet
+        MultisigWallet.forget_nodes()
+
+        if self.slot is not None:
+            # batch: signed in background, and doesn't own the UX; leave it alone
+            self.ux_done = True
+            self.finished = utime.ticks_ms()
+            return
+
+        super().done(redraw)
 
     def render_output(self, o):
         # Pretty-print a transactions output. 
@@ -632,7 +662,10 @@ class ApproveTransaction(UserAuthorizedAction):
         # step 1: parse PSBT from sflash into in-memory objects.
 
         try:
-            with SFFile(TXN_INPUT_OFFSET, length=self.psbt_len, message='Reading...') as fd:
+            # Mk4: PSBT is in memory-mapped PSRAM, so can be read with fewer copies
+            reader = PSRAMFile if has_psram else SFFile
+
+            with reader(self.in_offset, length=self.psbt_len, message='Reading...') as fd:
                 # NOTE: psbtObject captures the file descriptor and uses it later
                 self.psbt = psbtObject.read_psbt(fd)
         except BaseException as exc:
@@ -689,46 +722,17 @@ class ApproveTransaction(UserAuthorizedAction):
         #       - inputs we can't sign (no key)
         #
         try:
-            msg = uio.StringIO()
-
-            # mention warning at top
-            wl= len(self.psbt.warnings)
-            if wl == 1:
-                msg.write('(1 warning below)\n\n')
-            elif wl >= 2:
-                msg.write('(%d warnings below)\n\n' % wl)
-
-            self.output_summary_text(msg)
-            gc.collect()
-
-            fee = self.psbt.calculate_fee()
-            if fee is not None:
-                msg.write("\nNetwork fee:\n%s %s\n" % self.chain.render_value(fee))
-
-            # NEW: show where all the change outputs are going
-            self.output_change_text(msg)
-            gc.collect()
-
-            if self.psbt.warnings:
-                msg.write('\n---WARNING---\n\n')
-
-                for label, m in self.psbt.warnings:
-                    msg.write('- %s: %s\n\n' % (label, m))
-
-            if self.do_visualize:
-                # stop here and just return the text of approval message itself
-                self.result = await self.save_visualization(msg, (self.stxn_flags & STXN_SIGNED))
-                del self.psbt
-                self.done()
-
-                return
-
-            dis.progress_bar_show(1)  # finish the Validating...
-            if not hsm_active:
-                msg.write("\nPress OK to approve and sign transaction. X to abort.")
-                ch = await ux_show_story(msg, title="OK TO SEND?")
+            if hsm_active and not self.do_visualize:
+                # HSM mode: nobody will read a story, so don't build one; policy
+                # logs a compact record of the txn instead.
+                dis.progress_bar_show(1)  # finish the Validating...
+                ch = await hsm_active.approve_transaction(self.psbt, self.psbt_sha,
+                                                                self.user_auth)
             else:
-                ch = await hsm_active.approve_transaction(self.psbt, self.psbt_sha, msg.getvalue())
+                ch = await self.approval_story()
+                if ch is None:
+                    # visualization was saved; nothing to sign
+                    return
 
         except MemoryError:
             # recovery? maybe.
@@ -745,7 +749,8 @@ class ApproveTransaction(UserAuthorizedAction):
             # they don't want to!
             self.refused = True
 
-            await ux_dramatic_pause("Refused.", 1)
+            if self.slot is None:
+                await ux_dramatic_pause("Refused.", 1)
 
             del self.psbt
 
@@ -774,7 +779,7 @@ class ApproveTransaction(UserAuthorizedAction):
         txid = None
         try:
             # re-serialize the PSBT back out
-            with SFFile(TXN_OUTPUT_OFFSET, max_size=MAX_TXN_LEN, message="Saving...") as fd:
+            with SFFile(self.out_offset, max_size=self.out_max, message="Saving...") as fd:
                 await fd.erase()
 
                 if self.do_finalize:
@@ -819,6 +824,49 @@ class ApproveTransaction(UserAuthorizedAction):
         #if NFC:
             #NFC.share_signed_psbt(TXN_OUTPUT_OFFSET, self.result[0], self.result[1])
 
+    async def approval_story(self):
+        # Build the text a human needs to decide if this txn should be signed,
+        # and show it to them. Returns their choice, or None if only visualizing.
+        msg = uio.StringIO()
+
+        # mention warning at top
+        wl= len(self.psbt.warnings)
+        if wl == 1:
+            msg.write('(1 warning below)\n\n')
+        elif wl >= 2:
+            msg.write('(%d warnings below)\n\n' % wl)
+
+        self.output_summary_text(msg)
+        gc.collect()
+
+        fee = self.psbt.calculate_fee()
+        if fee is not None:
+            msg.write("\nNetwork fee:\n%s %s\n" % self.chain.render_value(fee))
+
+        # NEW: show where all the change outputs are going
+        self.output_change_text(msg)
+        gc.collect()
+
+        if self.psbt.warnings:
+            msg.write('\n---WARNING---\n\n')
+
+            for label, m in self.psbt.warnings:
+                msg.write('- %s: %s\n\n' % (label, m))
+
+        if self.do_visualize:
+            # stop here and just return the text of approval message itself
+            self.result = await self.save_visualization(msg, (self.stxn_flags & STXN_SIGNED))
+            del self.psbt
+            self.done()
+
+            return None
+
+        from glob import dis
+        dis.progress_bar_show(1)  # finish the Validating...
+
+        msg.write("\nPress OK to approve and sign transaction. X to abort.")
+        return await ux_show_story(msg, title="OK TO SEND?")
+
     def save_visualization(self, msg, sign_text=False):
         # write text into spi flash, maybe signing it as we go
         # - return length and checksum
@@ -827,7 +875,7 @@ class ApproveTransaction(UserAuthorizedAction):
 
         chk = self.chain.hash_message(msg_len=txt_len) if sign_text else None
 
-        with SFFile(TXN_OUTPUT_OFFSET, max_size=txt_len+300, message="Visualizing...") as fd:
+        with SFFile(self.out_offset, max_size=txt_len+300, message="Visualizing...") as fd:
             await fd.erase()
 
             while 1:
@@ -953,11 +1001,111 @@ class ApproveTransaction(UserAuthorizedAction):
 def sign_transaction(psbt_len, flags=0x0, psbt_sha=None):
     # transaction (binary) loaded into sflash/PSRAM already, checksum checked
     UserAuthorizedAction.check_busy(ApproveTransaction)
+    if BatchSigner.active and BatchSigner.active.busy:
+        # shares the same PSRAM
+        raise CCBusyError()
     UserAuthorizedAction.active_request = ApproveTransaction(psbt_len, flags, psbt_sha=psbt_sha)
 
     # kill any menu stack, and put our thing at the top
     abort_and_goto(UserAuthorizedAction.active_request)
 
+class BatchSigner:
+    # Pipelined signing of PSBT files over USB, in HSM mode on Mk4.
+    # - host uploads into a slot while other slots are being signed
+    # - slots are signed in the order they were started, in the background
+    # - each slot has its own result, and output file to download
+    # - result not collected after this long (ms): slot is freed; host gave up on it
+    active = None
+    result_timeout = 60000
+
+    def __init__(self):
+        self.slots = [None] * BATCH_NUM_SLOTS       # ApproveTransaction once started
+        self.checksums = [None] * BATCH_NUM_SLOTS   # of uploaded files
+        self.queue = []
+        self.task = None
+
+    @classmethod
+    def get(cls):
+        if not cls.active:
+            cls.active = cls()
+        cls.active.expire()
+        return cls.active
+
+    def expire(self):
+        # free slots which finished long ago, but were never collected
+        now = utime.ticks_ms()
+        for slot, req in enumerate(self.slots):
+            if req and req.ux_done \
+                    and utime.ticks_diff(now, req.finished) >= self.result_timeout:
+                self.slots[slot] = None
+
+    @property
+    def busy(self):
+        self.expire()
+        return any(self.slots)
+
+    def can_upload(self, slot):
+        # upload would trash input file, if that slot is in progress
+        req = self.slots[slot]
+        return not req or req.ux_done
+
+    def start(self, slot, psbt_len, flags, psbt_sha):
+        from glob import hsm_active
+        import uasyncio
+
+        UserAuthorizedAction.check_busy()
+        assert not self.slots[slot], 'slot busy'
+        assert not (flags & STXN_VISUALIZE), 'no UX in batch'
+
+        req = ApproveTransaction(psbt_len, flags, psbt_sha=psbt_sha, slot=slot)
+
+        # user auth given so far applies to this PSBT, not what's being signed now
+        req.user_auth = hsm_active.pending_auth
+        hsm_active.pending_auth = {}
+
+        self.slots[slot] = req
+        self.queue.append(req)
+
+        # next upload into slot must start over
+        self.checksums[slot] = None
+
+        if not self.task:
+            self.task = uasyncio.create_task(self.worker())
+
+    async def worker(self):
+        try:
+            while self.queue:
+                req = self.queue.pop(0)
+                try:
+                    await req.interact()
+                except BaseException as exc:
+                    req.failed = req.failed or problem_file_line(exc)
+                req.ux_done = True
+                req.finished = utime.ticks_ms()
+                req.psbt = None
+                gc.collect()
+        finally:
+            self.task = None
+
+    def result(self, slot):
+        # Has this slot finished? Same responses as for single PSBT case.
+        req = self.slots[slot]
+        if not req:
+            return b'err_No active request'
+
+        if not req.ux_done:
+            # still waiting in queue, or being signed now
+            return None
+
+        self.slots[slot] = None
+
+        if req.refused:
+            return b'refu'
+        if req.failed:
+            return b'err_' + req.failed.encode()
+
+        return req.result
+
 def psbt_encoding_taster(taste, psbt_len):
     # look at first 10 bytes, and detect file encoding (binary, hex, base64)
     # - return len is upper bound on size because of unknown whitespace
@@ -331,15 +331,44 @@ class Builder(object):
 
         password = encode_utf_16_le(password)
 
+        # Hash many (salt || password || counter) records per update: build a batch
+        # of them once, then patch just the counter bytes that change between batches.
+        # Batch is a power of two, so counter in record j is always (base + j).
+        rec_len = len(self.salt) + len(password) + 8
+        batch = min(256, rounds)
+        while batch > 16 and batch*rec_len > 8192:
+            batch //= 2
+
+        buf = bytearray(batch*rec_len)
+        for j in range(batch):
+            buf[j*rec_len:(j+1)*rec_len] = self.salt + password + pack('<Q', j)
+        ctrs = range(rec_len-8, len(buf), rec_len)
+
         result = sha256()
 
-        for i in range(rounds):
-            result.update(self.salt)
-            result.update(password)
-            temp = pack('<Q', i)
-            result.update(temp)
-            if i % 1000 == 0 and progress_fcn:
-                progress_fcn(i/rounds)
+        for base in range(0, rounds, batch):
+            if base:
+                if batch < 256:
+                    # low byte moves every batch
+                    lo = base & 0xff
+                    for o in ctrs:
+                        buf[o] = lo
+                        lo += 1
+
+                if not (base & 0xff):
+                    if base & 0xffff:
+                        hi = (base >> 8) & 0xff
+                        for o in ctrs:
+                            buf[o+1] = hi
+                    else:
+                        hi = pack('<Q', base)[1:]
+                        for o in ctrs:
+                            buf[o+1:o+8] = hi
+
+            result.update(buf)
+
+            if progress_fcn and not (base % 4096):
+                progress_fcn(base/rounds)
             
         return result.digest()
 
@@ -35,13 +35,17 @@ class OutptValueCache:
 
     # we keep extra entries here during the current power-up
     # as defense against using very large txn in the attack
+    # - list is in age order, and the tail of it is what we save
+    # - index maps encoded key => same entry, for lookups
     runtime_cache = []
+    _index = {}
     _cache_loaded = False
 
     @classmethod
     def clear(cls):
         # user action in danger zone menu
         cls.runtime_cache.clear()
+        cls._index.clear()
         cls._cache_loaded = True
         settings.remove_key(cls.KEY)
         settings.save()
@@ -52,6 +56,8 @@ class OutptValueCache:
         if not cls._cache_loaded:
             saved = settings.get(cls.KEY) or []
             cls.runtime_cache.extend(saved)
+            for v in saved:
+                cls._index[v[0:ENCKEY_LEN]] = v
             cls._cache_loaded = True
     
 
@@ -82,64 +88,87 @@ class OutptValueCache:
         return unpack('<Q', val)[0]
 
     @classmethod
-    def fetch_amount(cls, prevout):
+    def fetch_amount(cls, prevout, key=None):
         # Return the amount we expect for this utxo, if we have it, else None
         cls.load_cache()
 
         if not cls.runtime_cache:
             return None
 
-        key = cls.encode_key(prevout)
-        for v in cls.runtime_cache:
-            if v[0:ENCKEY_LEN] == key:
-                return cls.decode_value(prevout, v[ENCKEY_LEN:])
+        v = cls._index.get(key or cls.encode_key(prevout))
+        if v is None:
+            return None
 
-        return None
+        return cls.decode_value(prevout, v[ENCKEY_LEN:])
 
     @classmethod
     def verify_amount(cls, prevout, amount, in_idx):
-        # check this input either:
+        cls.verify_amounts([(prevout, amount, in_idx)])
+
+    @classmethod
+    def verify_amounts(cls, inputs):
+        # check each input, a (prevout, amount, in_idx) tuple, either:
         #   - not been seen before, in which case, record it
         #   - OR: the amount matches exactly, any previously-seend UTXO w/ same outpoint
         # raises IncorrectUTXOAmount with details if it fails, which should abort any signing
-        exp = cls.fetch_amount(prevout)
-
-        if exp is None:
-            # new entry, add it
-            cls.add(prevout, amount)
-
-        elif exp != amount:
-            # Found the hacking we are looking for!
-            ch = chains.current_chain()
-            exp, units = ch.render_value(exp, True)
-            amount, _ = ch.render_value(amount, True)
-
-            raise IncorrectUTXOAmount(in_idx, "Expected %s but PSBT claims %s %s" % (
-                                                exp, amount, units))
+        # - settings are updated once, at end, for all new entries
+        added = False
+        try:
+            for prevout, amount, in_idx in inputs:
+                key = cls.encode_key(prevout)
+                exp = cls.fetch_amount(prevout, key)
+
+                if exp is None:
+                    # new entry, add it
+                    cls._add(prevout, amount, key)
+                    added = True
+
+                elif exp != amount:
+                    # Found the hacking we are looking for!
+                    ch = chains.current_chain()
+                    exp, units = ch.render_value(exp, True)
+                    amount, _ = ch.render_value(amount, True)
+
+                    raise IncorrectUTXOAmount(in_idx, "Expected %s but PSBT claims %s %s" % (
+                                                        exp, amount, units))
+        finally:
+            if added:
+                cls.commit()
 
     @classmethod
     def add(cls, prevout, amount):
         # protect privacy, compress a little, and save it.
         # - we know it's not yet in our lists
-        key = cls.encode_key(prevout)
+        cls._add(prevout, amount)
+        cls.commit()
 
-        # memory management: can't store very much, so trim as needed
-        depth = HISTORY_SAVED
-        if settings.capacity > 0.8:
-            depth //= 2
+    @classmethod
+    def _add(cls, prevout, amount, key=None):
+        # add to in-memory list only; caller must commit()
+        key = key or cls.encode_key(prevout)
 
-        # also limit in-memory use
+        # limit in-memory use
         cls.load_cache()
         if len(cls.runtime_cache) >= HISTORY_MAX_MEM:
-            del cls.runtime_cache[0]
+            old = cls.runtime_cache.pop(0)
+            if cls._index.get(old[0:ENCKEY_LEN]) is old:
+                del cls._index[old[0:ENCKEY_LEN]]
 
         # save new addition
         assert len(key) == ENCKEY_LEN
         assert amount > 0
         entry = key + cls.encode_value(prevout, amount)
         cls.runtime_cache.append(entry)
+        cls._index[key] = entry
 
+    @classmethod
+    def commit(cls):
         # update what we're going to save long-term
+        # - memory management: can't store very much, so trim as needed
+        depth = HISTORY_SAVED
+        if settings.capacity > 0.8:
+            depth //= 2
+
         settings.set(cls.KEY, cls.runtime_cache[-depth:])
 
 # As we build new transaction, track what we need to capture
@@ -163,12 +192,14 @@ def add_segwit_utxos_finalize(txid):
     prevout = COutPoint(uint256_from_str(txid), 0) 
     for oi, amount in new_outpts:
         prevout.n = oi
-        OutptValueCache.add(prevout, amount)
+        OutptValueCache._add(prevout, amount)
 
+    OutptValueCache.commit()
     new_outpts.clear()
 
-# shortcut
+# shortcuts
 verify_amount = lambda *a: OutptValueCache.verify_amount(*a)
+verify_amounts = lambda a: OutptValueCache.verify_amounts(a)
     
 
 # EOF
@@ -18,6 +18,7 @@ from uhashlib import sha256
 from ucollections import OrderedDict
 from files import CardSlot, CardMissingError
 from serializations import CTxOut
+from psbt import calc_txid
 
 # where we save policy/config
 POLICY_FNAME = '/flash/hsm-policy.json'
@@ -31,6 +32,16 @@ MAX_SATS = const(2100000000000000)
 # too many refusals will cause reset
 ABSOLUTE_MAX_REFUSALS = const(100)
 
+# audit log text is buffered until this many bytes, or this many ms later
+AUDIT_FLUSH_SIZE = const(4096)
+AUDIT_FLUSH_MS = const(1000)
+
+# let go of the SD card after no logging for this long
+AUDIT_IDLE_MS = const(30000)
+
+# if the card can't be written, keep at most this much text for a later retry
+AUDIT_MAX_PENDING = const(16384)
+
 # you have this many seconds after boot to escape HSM
 # mode, if you enable the boot_to_hsm feature
 BOOT_LOCKOUT_TIME = const(60)
@@ -247,6 +258,15 @@ class ApprovalRule:
 
         assert_empty_dict(j)
 
+        # compiled form of above, so no per-txn work to interpret the rule
+        opts = self.whitelist_opts
+        self._whitelist = frozenset(self.whitelist)
+        self._attest = bool(opts and opts.attest)
+        self._allow_zeroval = bool(opts and opts.allow_zeroval_outs)
+        self._eq_ins_outs = "EQ_NUM_INS_OUTS" in self.patterns
+        self._eq_own_ins_outs = "EQ_NUM_OWN_INS_OUTS" in self.patterns
+        self._eq_amounts = "EQ_OUT_AMOUNTS" in self.patterns
+
     @property
     def has_velocity(self):
         return self.per_period is not None
@@ -322,56 +342,38 @@ class ApprovalRule:
 
         return rv
 
-    def matches_transaction(self, psbt, users, total_out, local_oked, chain):
-        # Does this rule apply to this PSBT file? 
+    def matches_transaction(self, facts, users, local_oked):
+        # Does this rule apply to this PSBT file? See TxnFacts for what we know about it.
         if self.wallet:
             # rule limited to one wallet
-            if psbt.active_multisig:
+            if facts.ms_name:
                 # if multisig signing, might need to match specific wallet name
-                assert self.wallet == psbt.active_multisig.name, 'wrong wallet'
+                assert self.wallet == facts.ms_name, 'wrong wallet'
             else:
                 # non multisig, but does this rule apply to all wallets or single-singers
                 assert self.wallet == '1', 'not multisig'
 
+        total_out = facts.total_out
         if self.max_amount is not None:
             assert total_out <= self.max_amount, 'amount exceeded'
 
-        attest_mode = self.whitelist_opts and self.whitelist_opts.attest
-        allow_zeroval = self.whitelist_opts and self.whitelist_opts.allow_zeroval_outs
-
-        # check all destinations are in the whitelist if mode is basic
-        if self.whitelist and not attest_mode:
-            dests = set()
-            for idx, txo in psbt.output_iter():
-                o = psbt.outputs[idx]
-                if o.is_change or (txo.nValue == 0 and allow_zeroval):
-                    continue
-
-                try:
-                    address = chain.render_address(txo.scriptPubKey)
-                except ValueError:
-                    address = str(b2a_hex(txo.scriptPubKey), 'ascii')
-
-                dests.add(address)
-
-            diff = dests - set(self.whitelist)
-            assert not diff, "non-whitelisted address: " + diff.pop()
-
-        # check all foreign outputs are attested if mode is attest
-        if self.whitelist and attest_mode:
-            for idx, txo in psbt.output_iter():
-                o = psbt.outputs[idx]
-                if o.is_change or (txo.nValue == 0 and allow_zeroval):
-                    continue
-                assert o.attestation, "missing attestation for output %i" % idx
-                # we are verifying the whole consensus-encoded txout
-                txo_bytes = CTxOut(txo.nValue, txo.scriptPubKey).serialize()
-                digest = chain.hash_message(txo_bytes)
-                addr_fmt, pubkey = chains.verify_recover_pubkey(o.attestation, digest)
-                # we have extracted a valid pubkey from the sig, but is it
-                # a whitelisted pubkey or something else?
-                ver_addr = chain.pubkey_to_address(pubkey, addr_fmt)
-                assert ver_addr in self.whitelist, 'non-whitelisted attestation key for output %i' % idx
+        if self.whitelist:
+            if not self._attest:
+                # check all destinations are in the whitelist if mode is basic
+                for addr in facts.dests(self._allow_zeroval):
+                    assert addr in self._whitelist, "non-whitelisted address: " + addr
+            else:
+                # check all foreign outputs are attested if mode is attest
+                for out in facts.foreign:
+                    idx, value, _, att = out
+                    if value == 0 and self._allow_zeroval:
+                        continue
+                    assert att, "missing attestation for output %i" % idx
+                    # we have extracted a valid pubkey from the sig, but is it
+                    # a whitelisted pubkey or something else?
+                    ver_addr = facts.attested_addr(out)
+                    assert ver_addr in self._whitelist, \
+                                'non-whitelisted attestation key for output %i' % idx
 
         if self.local_conf:
             # local user must approve
@@ -390,33 +392,222 @@ class ApprovalRule:
 
         # check the self-transfer percentage
         if self.min_pct_self_transfer:
-            own_in_value = sum([i.amount for i in psbt.inputs if i.num_our_keys])
-            own_out_value = 0
-            for idx, txo in psbt.output_iter():
-                o = psbt.outputs[idx]
-                if o.num_our_keys:
-                    own_out_value += txo.nValue
-            percentage = (float(own_out_value) / own_in_value) * 100.0
+            percentage = (float(facts.own_out_value) / facts.own_in_value) * 100.0
             assert percentage >= self.min_pct_self_transfer, 'does not meet self transfer threshold, expected: %.2f, actual: %.2f' % (self.min_pct_self_transfer, percentage)
 
         # check various patterns
 
-        if "EQ_NUM_INS_OUTS" in self.patterns:
-            assert len(psbt.inputs) == len(psbt.outputs), 'unequal number of inputs and outputs'
+        if self._eq_ins_outs:
+            assert facts.num_ins == facts.num_outs, 'unequal number of inputs and outputs'
 
-        if "EQ_NUM_OWN_INS_OUTS" in self.patterns:
-            own_ins = sum([1 for i in psbt.inputs if i.num_our_keys])
-            own_outs = sum([1 for o in psbt.outputs if o.num_our_keys])
-            assert own_ins == own_outs, 'unequal number of own inputs and outputs'
+        if self._eq_own_ins_outs:
+            assert facts.own_ins == facts.own_outs, 'unequal number of own inputs and outputs'
 
-        if "EQ_OUT_AMOUNTS" in self.patterns:
-            _, txo = next(psbt.output_iter())
-            wanted = txo.nValue
-            for _, txo in psbt.output_iter():
-                assert txo.nValue == wanted, 'not all output amounts are equal'
+        if self._eq_amounts:
+            assert facts.eq_amounts, 'not all output amounts are equal'
 
         return True
 
+class TxnFacts:
+    # Everything the rules need to know about a PSBT's outputs, gathered in
+    # a single pass so each rule doesn't walk the (maybe huge) txn again.
+    # - only foreign (non-change) outputs are kept, that's all whitelists look at
+    # - attestations are worked out on first use, then shared
+    # - since no story is rendered in HSM mode, we add the warning about odd scripts here
+    def __init__(self, psbt, chain):
+        self.chain = chain
+        self.ms_name = psbt.active_multisig.name if psbt.active_multisig else None
+        self.num_ins = len(psbt.inputs)
+        self.num_outs = len(psbt.outputs)
+
+        self.own_ins = 0
+        self.own_in_value = 0
+        for i in psbt.inputs:
+            if i.num_our_keys:
+                self.own_ins += 1
+                self.own_in_value += i.amount
+
+        self.total_out = 0          # applies to foreign outputs only
+        self.own_outs = 0
+        self.own_out_value = 0
+        self.eq_amounts = True
+        self.foreign = []           # (idx, nValue, scriptPubKey, attestation)
+        self._addrs = []            # rendered address for each of above
+
+        first = None
+        for idx, txo in psbt.output_iter():
+            o = psbt.outputs[idx]
+            if first is None:
+                first = txo.nValue
+            elif txo.nValue != first:
+                self.eq_amounts = False
+
+            if o.num_our_keys:
+                self.own_outs += 1
+                self.own_out_value += txo.nValue
+
+            if not o.is_change:
+                spk = txo.scriptPubKey
+                try:
+                    address = chain.render_address(spk)
+                except ValueError:
+                    address = str(b2a_hex(spk), 'ascii')
+                    if not chain.op_return(spk):
+                        psbt.warnings.append(
+                            ('Output?', 'Sending to a script that is not well understood.'))
+
+                self.total_out += txo.nValue
+                self.foreign.append((idx, txo.nValue, spk, o.attestation))
+                self._addrs.append(address)
+
+        self._dests = {}
+        self._attested = {}
+
+    def dests(self, allow_zeroval):
+        # set of rendered foreign destination addresses
+        rv = self._dests.get(allow_zeroval)
+        if rv is not None:
+            return rv
+
+        rv = set()
+        for addr, out in zip(self._addrs, self.foreign):
+            if out[1] == 0 and allow_zeroval:
+                continue
+            rv.add(addr)
+        self._dests[allow_zeroval] = rv
+        return rv
+
+    def attested_addr(self, out):
+        # address of key which signed the attestation for an output
+        # - out is one of self.foreign
+        idx, value, spk, att = out
+        rv = self._attested.get(idx)
+        if rv is not None:
+            return rv
+
+        # we are verifying the whole consensus-encoded txout
+        txo_bytes = CTxOut(value, spk).serialize()
+        digest = self.chain.hash_message(txo_bytes)
+        addr_fmt, pubkey = chains.verify_recover_pubkey(att, digest)
+        rv = self.chain.pubkey_to_address(pubkey, addr_fmt)
+        self._attested[idx] = rv
+        return rv
+
+class AuditWriter:
+    # Keeps the SD card mounted across requests, and buffers the text for each
+    # request's log file in RAM. Written out once enough is pending, or a moment later
+    # from a background task, which also lets go of the card when idle.
+    # - virtual disk is never held: USB is disabled while it's mounted
+    def __init__(self):
+        self.card = None
+        self.pending = []           # of (fname, text)
+        self.size = 0
+        self.last_used = 0
+        self.task = None
+
+    def mount(self):
+        self.card = CardSlot().__enter__()
+        self.vdisk = (self.card.mountpt != self.card.get_sd_root())
+        self.ejected = not CardSlot.is_inserted()
+        self.changed = CardSlot.last_change
+        self.dirs = set()
+
+    def release(self):
+        if self.card:
+            try:
+                self.card.__exit__(None, None, None)
+            except: pass
+            self.card = None
+
+    def open_dir(self, dirname):
+        # mount if needed, and return path of directory for logs; raises if no card
+        if self.card and ((not CardSlot.is_inserted()) != self.ejected
+                                    or CardSlot.last_change != self.changed):
+            # card has come or gone since we mounted
+            self.release()
+
+        if not self.card:
+            self.mount()
+
+        d = self.card.get_sd_root() + '/' + dirname
+
+        if d not in self.dirs:
+            # mkdir if needed
+            try: uos.stat(d)
+            except: uos.mkdir(d)
+            self.dirs.add(d)
+
+        if self.vdisk:
+            self.release()
+
+        self.start()
+
+        return d
+
+    def start(self):
+        self.last_used = utime.ticks_ms()
+        if not self.task:
+            import uasyncio
+            self.task = uasyncio.create_task(self.idle_task())
+
+    def write(self, fname, text):
+        self.pending.append((fname, text))
+        self.size += len(text)
+
+        if self.size >= AUDIT_FLUSH_SIZE:
+            try:
+                self.flush()
+            except BaseException as exc:
+                # kept, and tried again by idle task
+                sys.print_exception(exc)
+
+        self.start()
+
+    def flush(self):
+        # write everything pending to card; raises if that fails
+        if not self.pending:
+            return
+
+        try:
+            if not self.card:
+                self.mount()
+
+            while self.pending:
+                fname, text = self.pending[0]
+                with open(fname, 'a+t') as fd:      # append mode
+                    fd.write(text)
+                self.pending.pop(0)
+                self.size -= len(text)
+        except:
+            # card gone? keep text for next try, but only so much
+            self.release()
+            while self.size > AUDIT_MAX_PENDING:
+                fname, text = self.pending.pop(0)
+                self.size -= len(text)
+                print(text)         # lost, but at least on console
+            raise
+
+        if self.vdisk:
+            self.release()
+
+    async def idle_task(self):
+        import uasyncio
+
+        while 1:
+            await uasyncio.sleep_ms(AUDIT_FLUSH_MS)
+
+            try:
+                self.flush()
+            except BaseException as exc:
+                sys.print_exception(exc)
+
+            if utime.ticks_diff(utime.ticks_ms(), self.last_used) >= AUDIT_IDLE_MS:
+                self.release()
+                self.task = None
+                return
+
+audit_writer = AuditWriter()
+
 class AuditLogger:
     def __init__(self, dirname, digest, never_log):
         self.dirname = dirname
@@ -428,19 +619,13 @@ class AuditLogger:
             if self.never_log:
                 raise NotImplementedError
 
-            self.card = CardSlot().__enter__()
-
-            d  = self.card.get_sd_root() + '/' + self.dirname
+            d = audit_writer.open_dir(self.dirname)
 
-            # mkdir if needed
-            try: uos.stat(d)
-            except: uos.mkdir(d)
-                
             self.fname = d + '/' + b2a_hex(self.digest[-8:]).decode('ascii') + '.log'
-            self.fd = open(self.fname, 'a+t')       # append mode
+            self.fd = uio.StringIO()        # buffered, see AuditWriter
         except (CardMissingError, OSError, NotImplementedError):
             # may be fatal or not, depending on configuration
-            self.fname = self.card = None
+            self.fname = None
             self.fd = sys.stdout
 
         return self
@@ -452,19 +637,45 @@ class AuditLogger:
 
         self.fd.write('\n===\n\n')
 
-        if self.card:
-            assert self.fd != sys.stdout
-            self.fd.close()
-            self.card.__exit__(exc_type, exc_value, traceback)
+        if self.fname:
+            self.flush(False)
+
+    def flush(self, sync=True):
+        # pass along what we have so far; if sync, it's on the card when we return
+        if not self.fname:
+            return
+
+        audit_writer.write(self.fname, self.fd.getvalue())
+        self.fd = uio.StringIO()
+
+        if sync:
+            audit_writer.flush()
 
     @property
     def is_unsaved(self):
-        return not self.card
+        return not self.fname
 
     def info(self, msg):
         print(msg, file=self.fd)
         #if self.fd != sys.stdout: print(msg)
 
+    def txn_details(self, psbt, facts):
+        # Compact record of what is being signed, instead of the text a human
+        # would see: one line per output (amount in sats, sha256 of script).
+        txid = calc_txid(psbt.fd, psbt.txn)
+        self.info('TXID = ' + b2a_hex(bytes(reversed(txid))).decode('ascii'))
+        self.info('%d ins, %d outs, in=%s out=%s foreign=%d fee=%s' % (
+                    facts.num_ins, facts.num_outs, psbt.total_value_in,
+                    psbt.total_value_out, facts.total_out, psbt.calculate_fee()))
+
+        for idx, txo in psbt.output_iter():
+            self.info('out[%d] %d %s%s' % (idx, txo.nValue,
+                        b2a_hex(ngu.hash.sha256s(txo.scriptPubKey)).decode('ascii'),
+                        ' change' if psbt.outputs[idx].is_change else ''))
+
+        for label, m in psbt.warnings:
+            self.info('warning: %s: %s' % (label, m))
+
 class HSMPolicy:
     # implements and enforces the HSM signing/activity/logging policy
     def __init__(self):
@@ -805,7 +1016,8 @@ class HSMPolicy:
                 self.refuse(log, 'Message signing not enabled for that path')
                 return 'x'
 
-            self.approve(log, 'Message signing allowed')
+            if not self.approve(log, 'Message signing allowed'):
+                return 'x'
 
         return 'y'
 
@@ -870,7 +1082,7 @@ class HSMPolicy:
         from ubinascii import b2a_base64
         self.next_local_code = b2a_base64(ngu.random.bytes(15)).strip().decode('ascii')
 
-    async def approve_transaction(self, psbt, psbt_sha, story):
+    async def approve_transaction(self, psbt, psbt_sha, auth=None):
         # Approve or don't a transaction. Catch assertions and other
         # reasons for failing/rejecting into the log.
         # - return 'y' or 'x'
@@ -886,16 +1098,25 @@ class HSMPolicy:
 
             log.info('Transaction signing requested:')
             log.info('SHA256(PSBT) = ' + b2a_hex(psbt_sha).decode('ascii'))
-            log.info('-vvv-\n%s\n-^^^-' % story)
 
             # reset pending auth list and "consume" it now
-            auth = self.pending_auth
-            self.pending_auth = {}
+            # - unless batch signing, where it was captured when PSBT was queued
+            if auth is None:
+                auth = self.pending_auth
+                self.pending_auth = {}
 
             try:
                 # do this super early so always cleared even if other issues
                 local_ok = self.consume_local_code(psbt_sha)
 
+                # One pass over the outputs, shared by all the rules
+                facts = TxnFacts(psbt, chain)
+                total_out = facts.total_out
+
+                log.info('-vvv-')
+                log.txn_details(psbt, facts)
+                log.info('-^^^-')
+
                 if not self.rules:
                     raise ValueError("no txn signing allowed")
 
@@ -921,18 +1142,11 @@ class HSMPolicy:
                 if users:
                     log.info("These users gave correct auth codes: " + ', '.join(users))
 
-                # Totals (applies to foreign)
-                total_out = 0
-                for idx, txo in psbt.output_iter():
-                    outp = psbt.outputs[idx]
-                    if not outp.is_change:
-                        total_out += txo.nValue
-
                 # Pick a rule to apply to this specific txn
                 reasons = []
                 for rule in self.rules:
                     try:
-                        if rule.matches_transaction(psbt, users, total_out, local_ok, chain):
+                        if rule.matches_transaction(facts, users, local_ok):
                             break
                     except BaseException as exc:
                         # let's not share these details, except for debug; since
@@ -951,7 +1165,8 @@ class HSMPolicy:
                         msg += ', and the local operator.' if msg else 'local operator'
 
                 # looks good, do it
-                self.approve(log, "Acceptable by rule #%d" % rule.index)
+                if not self.approve(log, "Acceptable by rule #%d" % rule.index):
+                    return 'x'
 
                 if rule.per_period is not None:
                     self.record_spend(rule, total_out)
@@ -972,15 +1187,37 @@ class HSMPolicy:
         
         # Crash if too many refusals happen.
         if self.refusals >= ABSOLUTE_MAX_REFUSALS:
-            from utils import clean_shutdown, call_later_ms
-            call_later_ms(250, clean_shutdown)
+            from utils import call_later_ms
+            call_later_ms(250, self.shutdown)
+
+    async def shutdown(self):
+        from utils import clean_shutdown
+
+        # don't lose what's buffered for the log
+        try:
+            audit_writer.flush()
+        except: pass
+
+        clean_shutdown()
 
     def approve(self, log, msg):
-        # when things fail
+        # when things work; returns False if refused after all
         log.info("\nAPPROVED: " + msg)
+
+        if self.must_log:
+            # approval isn't released until it's written
+            try:
+                log.flush()
+            except BaseException as exc:
+                sys.print_exception(exc)
+                self.refuse(log, "Could not write log, and must_log is set")
+                return False
+
         self.approvals += 1
         self.last_refusal = None
 
+        return True
+
 
 def hsm_status_report():
     # Return a JSON-able object. Documented and external programs
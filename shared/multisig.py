@@ -20,6 +20,9 @@ TRUST_VERIFY = const(0)
 TRUST_OFFER = const(1)
 TRUST_PSBT = const(2)
 
+# max number of BIP-32 nodes held per wallet by get_node(); keys come from PSBT
+MS_NODE_CACHE_SIZE = const(64)
+
 
 class MultisigOutOfSpace(RuntimeError):
     pass
@@ -125,6 +128,14 @@ class MultisigWallet:
     # optional: user can short-circuit many checks (system wide, one power-cycle only)
     disable_checks = False
 
+    # saved wallets, deserialized once and indexed; see _registry()
+    _reg = None
+    _gen = 0        # bumped by each write of settings['multisig'], see changed()
+
+    # get_node() cache statistics, over all instances (see simulator)
+    node_hits = 0
+    node_misses = 0
+
     def __init__(self, name, m_of_n, xpubs, addr_fmt=AF_P2SH, chain_type='BTC'):
         self.storage_idx = -1
 
@@ -143,6 +154,10 @@ class MultisigWallet:
 
         assert len(self.xfp_paths) == self.N, 'dup XFP'         # not supported
 
+        # parsed BIP-32 nodes for xpubs, and some derived from those (see get_node)
+        # - only kept while working on one PSBT, see forget_nodes()
+        self._node_cache = {}
+
     @classmethod
     def render_addr_fmt(cls, addr_fmt):
         for k, v in cls.FORMAT_NAMES:
@@ -215,28 +230,64 @@ class MultisigWallet:
         return rv
 
     @classmethod
-    def iter_wallets(cls, M=None, N=None, not_idx=None, addr_fmt=None):
-        # yield MS wallets we know about, that match at least right M,N if known.
-        # - this is only place we should be searching this list, please!!
+    def _registry(cls):
+        # Instances for all saved wallets (reused, with their parsed xpubs) and indexes
+        # into them. Rebuilt when settings are (re)loaded, and after any write; see changed()
+        # - returns (source list, wallets, by (N, sorted xfps), set of (M, N, xor of xfps), gen)
         lst = settings.get('multisig', [])
 
+        reg = cls._reg
+        if reg and reg[0] is lst and reg[4] == cls._gen:
+            return reg
+
+        wallets = []
+        by_xfps = {}
+        by_xor = set()
         for idx, rec in enumerate(lst):
-            if idx == not_idx:
+            ms = cls.deserialize(rec, idx)
+            wallets.append(ms)
+
+            xfps = tuple(sorted(ms.xfp_paths))
+            by_xfps.setdefault((ms.N, xfps), []).append(ms)
+
+            x = 0
+            for xfp in xfps:
+                x ^= xfp
+            by_xor.add((ms.M, ms.N, x))
+
+        cls._reg = reg = (lst, wallets, by_xfps, by_xor, cls._gen)
+
+        return reg
+
+    @classmethod
+    def changed(cls):
+        # Call after writing settings['multisig'], even if same list object.
+        cls._gen += 1
+        cls._reg = None
+
+    @classmethod
+    def forget_nodes(cls):
+        # Done with a PSBT: drop the nodes cached by all saved wallets.
+        reg = cls._reg
+        if reg:
+            for ms in reg[1]:
+                ms._node_cache.clear()
+
+    @classmethod
+    def iter_wallets(cls, M=None, N=None, not_idx=None, addr_fmt=None):
+        # yield MS wallets we know about, that match at least right M,N if known.
+        # - this is only place we should be searching this list, please!!
+        for ms in cls._registry()[1]:
+            if ms.storage_idx == not_idx:
                 # ignore one by index
                 continue
 
-            if M or N:
-                # peek at M/N
-                has_m, has_n = tuple(rec[1])
-                if M is not None and has_m != M: continue
-                if N is not None and has_n != N: continue
+            if M is not None and ms.M != M: continue
+            if N is not None and ms.N != N: continue
 
-            if addr_fmt is not None:
-                opts = rec[3]
-                af = opts.get('ft', AF_P2SH)
-                if af != addr_fmt: continue
+            if addr_fmt is not None and ms.addr_fmt != addr_fmt: continue
                 
-            yield cls.deserialize(rec, idx)
+            yield ms
 
     def get_xfp_paths(self):
         # return list of lists [xfp, *deriv]
@@ -248,7 +299,12 @@ class MultisigWallet:
         # - xfp_paths is list of lists: [xfp, *path] like in psbt files
         # - M and N must be known
         # - returns instance, or None if not found
-        for rv in cls.iter_wallets(M, N, addr_fmt=addr_fmt):
+        xfps = tuple(sorted(x[0] for x in xfp_paths))
+
+        for rv in cls._registry()[2].get((N, xfps), ()):
+            if rv.M != M: continue
+            if addr_fmt is not None and rv.addr_fmt != addr_fmt: continue
+
             if rv.matching_subpaths(xfp_paths):
                 return rv
 
@@ -262,9 +318,13 @@ class MultisigWallet:
 
         # we know N, but not M at this point.
         N = len(xfp_paths)
+        xfps = tuple(sorted(x[0] for x in xfp_paths))
         
         matches = []
-        for rv in cls.iter_wallets(M=M, addr_fmt=addr_fmt):
+        for rv in cls._registry()[2].get((N, xfps), ()):
+            if M is not None and rv.M != M: continue
+            if addr_fmt is not None and rv.addr_fmt != addr_fmt: continue
+
             if rv.matching_subpaths(xfp_paths):
                 matches.append(rv)
 
@@ -308,16 +368,7 @@ class MultisigWallet:
     @classmethod
     def quick_check(cls, M, N, xfp_xor):
         # quicker? USB method.
-        rv = []
-        for ms in cls.iter_wallets(M, N):
-            x = 0
-            for xfp in ms.xfp_paths.keys():
-                x ^= xfp
-            if x != xfp_xor: continue
-
-            return True
-
-        return False
+        return (M, N, xfp_xor) in cls._registry()[3]
 
     @classmethod
     def get_all(cls):
@@ -332,14 +383,11 @@ class MultisigWallet:
     @classmethod
     def get_by_idx(cls, nth):
         # instance from index number (used in menu)
-        lst = settings.get('multisig', [])
         try:
-            obj = lst[nth]
+            return cls._registry()[1][nth]
         except IndexError:
             return None
 
-        return cls.deserialize(obj, nth)
-
     def commit(self):
         # data to save
         # - important that this fails immediately when nvram overflows
@@ -356,6 +404,7 @@ class MultisigWallet:
             v[self.storage_idx] = obj
 
         settings.set('multisig', v)
+        MultisigWallet.changed()
 
         # save now, rather than in background, so we can recover
         # from out-of-space situation
@@ -367,6 +416,7 @@ class MultisigWallet:
                 settings.set('multisig', orig)
                 settings.save()
             except: pass        # give up on recovery
+            MultisigWallet.changed()
 
             raise MultisigOutOfSpace
 
@@ -424,6 +474,7 @@ class MultisigWallet:
         lst = settings.get('multisig', [])
         del lst[self.storage_idx]
         settings.set('multisig', lst)
+        MultisigWallet.changed()
         settings.save()
 
         self.storage_idx = -1
@@ -433,6 +484,32 @@ class MultisigWallet:
         return set(xp_idx for xp_idx, (wxfp, _, _) in enumerate(self.xpubs)
                         if wxfp == xfp)
 
+    def get_node(self, xp_idx, subpath=()):
+        # Return BIP-32 node for co-signer's xpub, derived further by subpath (non-hardened).
+        # - base58 decode and derivations are cached, so caller gets a copy it can modify
+        key = (xp_idx, tuple(subpath))
+        node = self._node_cache.get(key)
+
+        if node is not None:
+            MultisigWallet.node_hits += 1
+        else:
+            MultisigWallet.node_misses += 1
+
+            if subpath:
+                node = self.get_node(xp_idx, subpath[:-1])
+                node.derive(subpath[-1], False)
+            else:
+                node = self.chain.deserialize_node(self.xpubs[xp_idx][-1], AF_P2SH)
+                assert node
+
+            if len(self._node_cache) >= MS_NODE_CACHE_SIZE:
+                # evict one
+                self._node_cache.popitem()
+
+            self._node_cache[key] = node
+
+        return node.copy()
+
     def yield_addresses(self, start_idx, count, change_idx=0):
         # Assuming a suffix of /0/0 on the defined prefix's, yield
         # possible deposit addresses for this wallet. Never show
@@ -446,10 +523,9 @@ class MultisigWallet:
         # setup
         nodes = []
         paths = []
-        for xfp, deriv, xpub in self.xpubs:
+        for xp_idx, (xfp, deriv, xpub) in enumerate(self.xpubs):
             # load bip32 node for each cosigner
-            node = ch.deserialize_node(xpub, AF_P2SH)
-            node.derive(change_idx, False)
+            node = self.get_node(xp_idx, (change_idx,))
             # indicate path used (for UX)
             path = "[%s/%s/%d/{idx}]" % (xfp2str(xfp), deriv[2:], change_idx)
             nodes.append(node)
@@ -514,9 +590,7 @@ class MultisigWallet:
             too_shallow = False
             for xp_idx, path in check_these:
                 # matched fingerprint, try to make pubkey that needs to match
-                xpub = self.xpubs[xp_idx][-1]
-
-                node = ch.deserialize_node(xpub, AF_P2SH); assert node
+                node = self.get_node(xp_idx)
                 dp = node.depth()
 
                 #print("%s => deriv=%s dp=%d len(path)=%d path=%s" %
@@ -530,7 +604,11 @@ class MultisigWallet:
 
                 for sp in path[dp:]:
                     assert not (sp & 0x80000000), 'hard deriv'
-                    node.derive(sp, False)     # works in-place
+
+                if dp < len(path):
+                    # branch node (ie. change/receive) is cached, so one step here
+                    node = self.get_node(xp_idx, path[dp:-1])
+                    node.derive(path[-1], False)     # works in-place
 
                 found_pk = node.pubkey()
 
@@ -45,6 +45,9 @@ RF_MNGT = const(0x03)       # RF interface state after Power ON
 I2C_CFG = const(0x0e)
 I2C_PWD = const(0x900)      # I2C security session password, 8 bytes
 
+# user memory is programmed in rows of this size (bytes)
+EE_ROW = const(16)
+
 class NFCHandler:
     def __init__(self):
         from machine import I2C, Pin
@@ -84,12 +87,38 @@ class NFCHandler:
         # various limits in place here? Not clear
         self.i2c.writeto_mem(I2C_ADDR_USER, offset, data, addrsize=16)
 
+    def dirty_runs(self, data, header_last=False):
+        # compare data against what's already at start of flash, by EEPROM row.
+        # - returns (start, end) of each run of rows that must be written
+        # - runs stay inside a 256-byte block: max size of one i2c write
+        # - optionally, move first row (CC file and NDEF length) to the end
+        rv = []
+        for blk in range(0, len(data), 256):
+            was = self.read(blk, min(256, len(data) - blk))
+
+            run = None
+            for pos in range(blk, blk+len(was), EE_ROW):
+                end = min(pos+EE_ROW, len(data))
+                if was[pos-blk:end-blk] == data[pos:end]:
+                    run = None
+                elif run and not (header_last and pos == EE_ROW):
+                    run[1] = end
+                else:
+                    run = [pos, end]
+                    rv.append(run)
+
+        if header_last and rv and rv[0][0] == 0:
+            rv.append(rv.pop(0))
+
+        return rv
+
     async def big_write(self, data):
         # write lots to start of flash (new ndef records)
-        for pos in range(0, len(data), 256):
-            here = memoryview(data)[pos:pos+256]
-            self.i2c.writeto_mem(I2C_ADDR_USER, pos, here, addrsize=16)
-            # 6ms per 16 byte row, worst case, so ~100ms here!
+        # - only rows that differ from what's there now: about 6ms each
+        # - first row is written last, so the tag never describes records
+        #   that are not fully there yet
+        for pos, end in self.dirty_runs(data, header_last=True):
+            self.write(pos, memoryview(data)[pos:end])
             await self.wait_ready()
 
     async def wipe(self, full_wipe):
@@ -97,14 +126,15 @@ class NFCHandler:
         # once we're done in case it's sensitive. But too slow to
         # clear entire chip most of time, just do first 512 bytes,
         # and dont wait for last to complete
+        # - rows already blank are not rewritten
         from glob import dis
-        here = bytes(256)
-        end = 8196
-        for pos in range(0, end, 256) :
-            self.i2c.writeto_mem(I2C_ADDR_USER, pos, here, addrsize=16)
-            if pos == 256 and not full_wipe: break
+        end = 8192 if full_wipe else 512
+        runs = self.dirty_runs(bytes(end))
+        for n, (pos, e) in enumerate(runs):
+            self.write(pos, bytes(e - pos))
+            if not full_wipe and n == len(runs)-1: break
 
-            # 6ms per 16 byte row, worst case, so ~100ms here per iter! 3.2seconds total
+            # 6ms per 16 byte row, worst case, so up to 3.2seconds total
             if full_wipe:
                 dis.progress_bar_show(pos / end)
             await self.wait_ready()
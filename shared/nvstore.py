@@ -93,6 +93,7 @@ class SettingsObject:
     def __init__(self, dis=None):
         self.is_dirty = 0
         self.my_pos = None
+        self.written = None         # (pos, key) of last save, if nothing changed since
 
         self.nvram_key = b'\0'*32
         self.capacity = 0
@@ -145,6 +146,7 @@ class SettingsObject:
 
         # for restore from backup case, or when changing (created) the seed
         self.nvram_key = key
+        self.written = None
 
     def get_capacity(self):
         # percent space used (0.0=>empty)
@@ -209,13 +211,12 @@ class SettingsObject:
             from sram2 import nvstore_buf as _tmp
 
             with SFFile(pos, length=4096, pre_erased=True) as fd:
-                for i in range(4096/32):        
-                    b = decryptor(fd.read(32))
-                    if i != 127:
-                        _tmp[i*32:(i*32)+32] = b
-                        chk.update(b)
-                    else:
-                        expect = b
+                # whole slot in one pass: data, then checksum
+                fd.readinto(_tmp)
+                _tmp[:] = decryptor(_tmp)
+                chk.update(_tmp)
+
+                expect = decryptor(fd.read(32))
 
             # check how much space was used for encoded JSON
             try:
@@ -244,57 +245,38 @@ class SettingsObject:
                 return rv, expect, digest
 
     def _write_slot(self, pos, aes):
-        # SHA-256 over plaintext
-        chk = sha256()
+        # serialize the data into JSON, pad w/ zeros to 4k (at least, on Mk4)
+        # and add SHA-256 over that plaintext, then encrypt all at once
+        d = ujson.dumps(self.current).encode()
 
-        # serialize the data into JSON
-        d = ujson.dumps(self.current)
+        dat_len = len(d)
+        pad_len = (4096-32) - dat_len
 
         if mk_num <= 3:
-            with SFFile(pos, max_size=4096, pre_erased=True) as fd:
-                # pad w/ zeros
-                dat_len = len(d)
-                pad_len = (4096-32) - dat_len
-                assert pad_len >= 0, 'too big'
-
-                self.capacity = dat_len / 4096
-
-                fd.write(aes(d))
-                chk.update(d)
-                del d
-
-                while pad_len > 0:
-                    here = min(32, pad_len)
+            assert pad_len >= 0, 'too big'
+            self.capacity = dat_len / 4096
+
+        if pad_len >= 0:
+            # build plaintext in place
+            from sram2 import nvstore_buf as buf
+            buf[0:dat_len] = d
+            buf[dat_len:] = bytes(pad_len)
+        else:
+            # mk4: larger than 4k is okay, no padding
+            buf = d
+        del d
 
-                    pad = bytes(here)
-                    fd.write(aes(pad))
-                    chk.update(pad)
+        chk = ngu.hash.sha256s(buf)
 
-                    pad_len -= here
-            
-                fd.write(aes(chk.digest()))
+        if mk_num <= 3:
+            with SFFile(pos, max_size=4096, pre_erased=True) as fd:
+                fd.write(aes(buf))
+                fd.write(aes(chk))
                 assert fd.tell() == 4096
         else:
             with self._open_file(pos, 'wb') as fd:
-                # pad w/ zeros at least to 4k, but allow larger
-                dat_len = len(d)
-                pad_len = (4096-32) - dat_len
-
-                fd.write(aes(d))
-                assert fd.tell() == dat_len
-                chk.update(d)
-                del d
-
-                while pad_len > 0:
-                    here = min(32, pad_len)
-
-                    pad = bytes(here)
-                    fd.write(aes(pad))
-                    chk.update(pad)
-
-                    pad_len -= here
-            
-                fd.write(aes(chk.digest()))
+                fd.write(aes(buf))
+                fd.write(aes(chk))
 
     def _used_slots(self):
         # mk4: faster list of slots in use; doesn't open them
@@ -342,6 +324,7 @@ class SettingsObject:
         self.overrides.clear()
         self.my_pos = None
         self.is_dirty = 0
+        self.written = None
         self.capacity = 0
         nonempty = set()
 
@@ -412,6 +395,7 @@ class SettingsObject:
             return self.current.get(kn, default)
 
     def changed(self):
+        self.written = None
         self.is_dirty += 1
         if self.is_dirty < 2:
             call_later_ms(250, self.write_out)
@@ -494,6 +478,11 @@ class SettingsObject:
     def save(self):
         # render as JSON, encrypt and write it.
 
+        if not self.is_dirty and self.written == (self.my_pos, self.nvram_key) \
+                and not self._slot_is_blank(self.my_pos, bytearray(4)):
+            # nothing changed since we wrote it, and it's still there
+            return
+
         self.current['_age'] = self.current.get('_age', 1) + 1
 
         pos = self.find_spot(self.my_pos)
@@ -508,10 +497,12 @@ class SettingsObject:
 
         self.my_pos = pos
         self.is_dirty = 0
+        self.written = (pos, self.nvram_key)
 
     def merge(self, prev):
         # take a dict of previous values and merge them into what we have
         self.current.update(prev)
+        self.changed()
 
     def blank(self):
         # erase current copy of values in nvram; older ones may exist still
@@ -519,6 +510,7 @@ class SettingsObject:
         if self.my_pos is not None:
             self._wipe_slot(self.my_pos)
             self.my_pos = 0
+        self.written = None
 
         # act blank too, just in case.
         self.current.clear()
@@ -43,6 +43,9 @@ DEFAULT_MAX_FEE_PERCENTAGE = const(10)
 # print some things, sometimes
 DEBUG = ckcc.is_simulator()
 
+# size of a CTxIn with empty scriptSig: outpoint + zero-length script + nSequence
+BLANK_TXIN_SIZE = const(32+4+1+4)
+
 class HashNDump:
     def __init__(self, d=None):
         self.rv = sha256()
@@ -135,6 +138,11 @@ def get_hash256(fd, poslen, hasher=None):
     rv = hasher or sha256()
 
     fd.seek(pos)
+    if hasattr(fd, 'view'):
+        # memory-mapped (PSRAMFile): hash in place
+        rv.update(fd.view(ll))
+        ll = 0
+
     while ll:
         here = fd.readinto(psbt_tmp256)
         if not here: break
@@ -175,7 +183,7 @@ class psbtProxy:
     no_keys = ()
 
     # these fields will return None but are not stored unless a value is set
-    blank_flds = ('unknown', )
+    blank_flds = {'unknown'}
 
     def __init__(self):
         self.fd = None
@@ -224,10 +232,18 @@ class psbtProxy:
             (pos, ll) = val
             out_fd.write(ser_compact_size(ll))
             self.fd.seek(pos)
-            while ll:
-                t = self.fd.read(min(64, ll))
-                out_fd.write(t)
-                ll -= len(t)
+
+            if hasattr(self.fd, 'view'):
+                # memory-mapped (PSRAMFile): copy directly, in one go
+                out_fd.write(self.fd.view(ll))
+            else:
+                # stream thru a reusable buffer; no allocations
+                buf = memoryview(psbt_tmp256)
+                while ll:
+                    here = self.fd.readinto(buf[0:min(len(buf), ll)])
+                    assert here, 'eof'
+                    out_fd.write(buf[0:here])
+                    ll -= here
 
         elif isinstance(val, list):
             # for subpaths lists (LE32 ints)
@@ -304,9 +320,9 @@ class psbtProxy:
 #
 class psbtOutputProxy(psbtProxy):
     no_keys = { PSBT_OUT_REDEEM_SCRIPT, PSBT_OUT_WITNESS_SCRIPT }
-    blank_flds = ('unknown', 'subpaths', 'redeem_script', 'witness_script',
+    blank_flds = {'unknown', 'subpaths', 'redeem_script', 'witness_script',
                     'is_change', 'num_our_keys', 'amount', 'address', 'scriptpubkey',
-                    'attestation')
+                    'attestation'}
 
     def __init__(self, fd, idx):
         super().__init__()
@@ -515,20 +531,21 @@ class psbtInputProxy(psbtProxy):
                      PSBT_IN_REDEEM_SCRIPT, PSBT_IN_WITNESS_SCRIPT, PSBT_IN_FINAL_SCRIPTSIG,
                      PSBT_IN_FINAL_SCRIPTWITNESS }
 
-    blank_flds = ('unknown',
+    blank_flds = {'unknown', 'part_sig', 'subpaths',
                     'utxo', 'witness_utxo', 'sighash',
                     'redeem_script', 'witness_script', 'fully_signed',
                     'is_segwit', 'is_multisig', 'is_p2sh', 'num_our_keys',
-                    'required_key', 'scriptSig', 'amount', 'scriptCode', 'added_sig')
+                    'required_key', 'scriptSig', 'amount', 'scriptCode', 'added_sig',
+                    'utxo_outs'}
 
     def __init__(self, fd, idx):
         super().__init__()
 
         #self.utxo = None
         #self.witness_utxo = None
-        self.part_sig = {}
+        #self.part_sig = None        # a dictionary if non-empty
         #self.sighash = None
-        self.subpaths = {}          # will typically be non-empty for all inputs
+        #self.subpaths = None        # will typically be non-empty for all inputs
         #self.redeem_script = None
         #self.witness_script = None
 
@@ -573,23 +590,36 @@ class psbtInputProxy(psbtProxy):
             # - seems harmless if they fool us into thinking already signed; we do nothing
             # - could also look at pubkey needed vs. sig provided
             # - could consider structure of MofN in p2sh cases
-            self.fully_signed = (len(self.part_sig) >= len(self.subpaths))
+            self.fully_signed = (len(self.part_sig) >= len(self.subpaths or ()))
         else:
             # No signatures at all yet for this input (typical non multisig)
             self.fully_signed = False
 
         if self.utxo:
-            # Important: they might be trying to trick us with an un-related
-            # funding transaction (UTXO) that does not match the input signature we're making
-            # (but if it's segwit, the ploy wouldn't work, Segwit FtW)
-            # - challenge: it's a straight dsha256() for old serializations, but not for newer
-            #   segwit txn's... plus I don't want to deserialize it here.
-            try:
-                observed = uint256_from_str(calc_txid(self.fd, self.utxo))
-            except:
-                raise AssertionError("Trouble parsing UTXO given for input #%d" % idx)
+            known = parent.utxo_index.get(txin.prevout.hash)
+
+            if known:
+                # Another input spends from same funding txn, and we've already
+                # verified a copy of it. Use that copy (and its output offsets)
+                # from now on, and don't bother hashing this one.
+                if known[1] is None:
+                    # first time it's shared: first input gets the same list
+                    known[1] = known[2].utxo_outs = []
+                self.utxo, self.utxo_outs = known[0], known[1]
+            else:
+                # Important: they might be trying to trick us with an un-related
+                # funding transaction (UTXO) that does not match the input signature we're making
+                # (but if it's segwit, the ploy wouldn't work, Segwit FtW)
+                # - challenge: it's a straight dsha256() for old serializations, but not for newer
+                #   segwit txn's... plus I don't want to deserialize it here.
+                try:
+                    observed = uint256_from_str(calc_txid(self.fd, self.utxo))
+                except:
+                    raise AssertionError("Trouble parsing UTXO given for input #%d" % idx)
+
+                assert txin.prevout.hash == observed, "utxo hash mismatch for input #%d" % idx
 
-            assert txin.prevout.hash == observed, "utxo hash mismatch for input #%d" % idx
+                parent.utxo_index[observed] = [self.utxo, None, self]
 
     def handle_none_sighash(self):
         if self.sighash is None:
@@ -623,6 +653,18 @@ class psbtInputProxy(psbtProxy):
 
         assert self.utxo, 'no utxo'
 
+        outs = self.utxo_outs
+        if outs:
+            # funding txn shared w/ other inputs, and we know where each output is
+            assert idx < len(outs), "not enuf outs"
+            fd.seek(outs[idx])
+
+            utxo = CTxOut()
+            utxo.deserialize(fd)
+            fd.seek(old_pos)
+
+            return utxo
+
         # skip over all the parts of the txn we don't care about, without
         # fully parsing it... pull out a single TXO
         fd.seek(self.utxo[0])
@@ -640,7 +682,14 @@ class psbtInputProxy(psbtProxy):
 
         num_out = deser_compact_size(fd)
         assert idx < num_out, "not enuf outs"
-        _skip_n_objs(fd, idx, 'CTxOut')
+
+        if outs is not None:
+            # funding txn is shared w/ other inputs: capture position of all outputs
+            for i in range(num_out):
+                outs.append(_skip_n_objs(fd, 1, 'CTxOut'))
+            fd.seek(outs[idx])
+        else:
+            _skip_n_objs(fd, idx, 'CTxOut')
 
         utxo = CTxOut()
         utxo.deserialize(fd)
@@ -819,8 +868,12 @@ class psbtInputProxy(psbtProxy):
         elif kt == PSBT_IN_WITNESS_UTXO:
             self.witness_utxo = val
         elif kt == PSBT_IN_PARTIAL_SIG:
+            if not self.part_sig:
+                self.part_sig = {}
             self.part_sig[key[1:]] = val
         elif kt == PSBT_IN_BIP32_DERIVATION:
+            if not self.subpaths:
+                self.subpaths = {}
             self.subpaths[key[1:]] = val
         elif kt == PSBT_IN_REDEEM_SCRIPT:
             self.redeem_script = val
@@ -856,8 +909,9 @@ class psbtInputProxy(psbtProxy):
         if self.sighash is not None:
             wr(PSBT_IN_SIGHASH_TYPE, pack('<I', self.sighash))
 
-        for k in self.subpaths:
-            wr(PSBT_IN_BIP32_DERIVATION, self.subpaths[k], k)
+        if self.subpaths:
+            for k in self.subpaths:
+                wr(PSBT_IN_BIP32_DERIVATION, self.subpaths[k], k)
 
         if self.redeem_script:
             wr(PSBT_IN_REDEEM_SCRIPT, self.redeem_script)
@@ -894,22 +948,33 @@ class psbtObject(psbtProxy):
         self.num_outputs = None
         self.vin_start = None
         self.vout_start = None
+        self.vout_end = None
         self.wit_start = None
         self.txn_version = None
         self.lock_time = None
         self.total_value_out = None
         self.total_value_in = None
         self.presigned_inputs = set()
+
+        # non-witness UTXO's (funding txns) already verified, by txid:
+        #   [(pos, len), None or list of each output's file position, first input spending it]
+        self.utxo_index = {}
         # will be tru if number of change outputs equals to total number of outputs
         self.consolidation_tx = False
         # number of change outputs
         self.num_change_outputs = None
 
-        # when signing segwit stuff, there is some re-use of hashes
-        # only if SIGHASH_ALL
+        # when signing segwit stuff, there is some re-use of hashes (BIP-143)
+        # - built once, for all sighash types needed; see calc_segwit_hashes
+        # - hash_single: output index => hash of that one output, for SIGHASH_SINGLE
         self.hashPrevouts = None
         self.hashSequence = None
         self.hashOutputs = None
+        self.hash_single = None
+
+        # for legacy (non-segwit) signing: all the inputs, serialized once with
+        # blank scriptSig's, keyed by whether nSequence values are zeroed
+        self.blanked_inputs = {}
 
         # this points to a MS wallet, during operation
         # - we are only supporting a single multisig wallet during signing
@@ -992,6 +1057,7 @@ class psbtObject(psbtProxy):
         self.num_outputs = deser_compact_size(fd)
 
         self.vout_start = _skip_n_objs(fd, self.num_outputs, 'CTxOut')
+        self.vout_end = fd.tell()
 
         end_pos = sum(self.txn)
 
@@ -1337,9 +1403,17 @@ class psbtObject(psbtProxy):
         # hashes match, and what values are we getting?
         # Important: parse incoming UTXO to build total input value
         foreign = []
+        segwit_amounts = []
         total_in = 0
 
+        # shared parts of BIP-143 sighash, kept if segwit inputs need them
+        prevouts = sha256()
+        sequences = sha256()
+
         for i, txi in self.input_iter():
+            prevouts.update(txi.prevout.serialize())
+            sequences.update(pack("<I", txi.nSequence))
+
             inp = self.inputs[i]
             if inp.fully_signed:
                 self.presigned_inputs.add(i)
@@ -1368,10 +1442,17 @@ class psbtObject(psbtProxy):
             # iff to UTXO is segwit, then check it's value, and also
             # capture that value, since it's supposed to be immutable
             if inp.is_segwit:
-                history.verify_amount(txi.prevout, inp.amount, i)
+                segwit_amounts.append((txi.prevout, inp.amount, i))
 
             del utxo
 
+        # checked all together, so settings updated only once
+        history.verify_amounts(segwit_amounts)
+        del segwit_amounts
+
+        self.calc_segwit_hashes(prevouts, sequences)
+        del prevouts, sequences
+
         # XXX scan witness data provided, and consider those ins signed if not multisig?
 
         if not foreign:
@@ -1460,7 +1541,27 @@ class psbtObject(psbtProxy):
         rv.parse_txn()
 
         rv.inputs = [psbtInputProxy(fd, idx) for idx in range(rv.num_inputs)]
-        rv.outputs = [psbtOutputProxy(fd, idx) for idx in range(rv.num_outputs)]
+        rv.outputs = rv.read_outputs(fd)
+
+        return rv
+
+    def read_outputs(self, fd):
+        # Outputs without any PSBT fields (typical when not ours) all share a single
+        # proxy, which is never changed, so each costs just a list slot.
+        rv = []
+        blank = None
+        for idx in range(self.num_outputs):
+            pos = fd.tell()
+            empty = (fd.read(1) == b'\0')
+            if empty and blank:
+                rv.append(blank)
+                continue
+
+            fd.seek(pos)
+            here = psbtOutputProxy(fd, idx)
+            if empty:
+                blank = here
+            rv.append(here)
 
         return rv
 
@@ -1675,15 +1776,56 @@ class psbtObject(psbtProxy):
         dis.progress_bar_show(1)
 
 
+    def get_blanked_inputs(self, zero_seq=False):
+        # Serialize all the txn's inputs, with empty scriptSig, into a single buffer.
+        # - built once per PSBT, then re-used for each legacy input we sign
+        # - fixed size records, so input N is at N * BLANK_TXIN_SIZE
+        # - zero_seq: nSequence values are zeroed (for SIGHASH_NONE/SINGLE)
+        rv = self.blanked_inputs.get(zero_seq)
+        if rv is not None:
+            return rv
+
+        fd = self.fd
+        old_pos = fd.tell()
+
+        rv = bytearray(BLANK_TXIN_SIZE * self.num_inputs)
+
+        fd.seek(self.vin_start)
+        pos = 0
+        for idx in range(self.num_inputs):
+            # prevout (hash, n), copied verbatim
+            rv[pos:pos+36] = fd.read(36)
+
+            # skip whatever scriptSig is there; we want it empty
+            fd.seek(deser_compact_size(fd), 1)
+            seq = fd.read(4)
+
+            # rv[pos+36] is already zero: empty scriptSig
+            if not zero_seq:
+                rv[pos+37:pos+41] = seq
+
+            pos += BLANK_TXIN_SIZE
+
+        fd.seek(old_pos)
+
+        self.blanked_inputs[zero_seq] = rv
+
+        return rv
+
     def make_txn_sighash(self, replace_idx, replacement, sighash_type):
         # calculate the hash value for one input of current transaction
         # - blank all script inputs
         # - except one single tx in, which is provided
         # - serialize that without witness data
         # - sha256 over that
+        # - other inputs come pre-serialized from get_blanked_inputs() and outputs
+        #   are hashed straight from the file, so no re-parsing per input signed
         fd = self.fd
         old_pos = fd.tell()
 
+        assert not self.inputs[replace_idx].is_segwit
+        assert replacement.scriptSig
+
         # sighash regardless of ANYONECANPAY input part
         out_sighash_type = sighash_type & 0x7f
 
@@ -1693,22 +1835,21 @@ class psbtObject(psbtProxy):
         rv.update(pack('<i', self.txn_version))           # nVersion
 
         # inputs
-        num_inputs = 1 if sighash_type & SIGHASH_ANYONECANPAY else self.num_inputs
-        rv.update(ser_compact_size(num_inputs))
-        for in_idx, txi in self.input_iter():
-            if in_idx == replace_idx:
-                assert not self.inputs[in_idx].is_segwit
-                assert replacement.scriptSig
-                rv.update(replacement.serialize())
-            elif not (sighash_type & SIGHASH_ANYONECANPAY):
-                if out_sighash_type in (SIGHASH_NONE, SIGHASH_SINGLE):
-                    # do not include sequence of other inputs (zero them for digest)
-                    # which means that they can be replaced
-                    txi.nSequence = 0
-                txi.scriptSig = b''
-                rv.update(txi.serialize())
-            # else:
-            #    is SIGHASH_ANYONECANPAY so we do not include any other inputs
+        if sighash_type & SIGHASH_ANYONECANPAY:
+            # we do not include any other inputs
+            rv.update(ser_compact_size(1))
+            rv.update(replacement.serialize())
+        else:
+            # for NONE and SINGLE, do not include sequence of other inputs (zero
+            # them for digest) which means that they can be replaced
+            blanked = self.get_blanked_inputs(
+                                out_sighash_type in (SIGHASH_NONE, SIGHASH_SINGLE))
+            split = replace_idx * BLANK_TXIN_SIZE
+
+            rv.update(ser_compact_size(self.num_inputs))
+            rv.update(memoryview(blanked)[0:split])
+            rv.update(replacement.serialize())
+            rv.update(memoryview(blanked)[split+BLANK_TXIN_SIZE:])
 
         # outputs
         if out_sighash_type == SIGHASH_NONE:
@@ -1724,8 +1865,9 @@ class psbtObject(psbtProxy):
         else:
             assert out_sighash_type == SIGHASH_ALL
             rv.update(ser_compact_size(self.num_outputs))
-            for out_idx, txo in self.output_iter():
-                rv.update(txo.serialize())
+
+            # outputs are contiguous and unchanged in unsigned txn: hash them as-is
+            get_hash256(fd, (self.vout_start, self.vout_end - self.vout_start), hasher=rv)
 
         # locktime, sighash_type
         rv.update(pack('<II', self.lock_time, sighash_type))
@@ -1735,70 +1877,107 @@ class psbtObject(psbtProxy):
         # double SHA256
         return ngu.hash.sha256s(rv.digest())
 
-    def make_txn_segwit_sighash(self, replace_idx, replacement, amount, scriptCode, sighash_type):
-        # Implement BIP 143 hashing algo for signature of segwit programs.
-        # see <https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki>
-        #
-        fd = self.fd
-        old_pos = fd.tell()
+    def calc_segwit_hashes(self, prevouts=None, sequences=None, extra=None):
+        # Build the shared BIP-143 hashes, for every sighash type our segwit inputs
+        # use, so each input's digest is constant time later.
+        # - prevouts/sequences: hashes in progress over all inputs, if caller has them
+        # - for SIGHASH_SINGLE, the hash of each corresponding output
+        # - extra: (input index, sighash type) also needed, beyond what inputs declare
+        types = set()
+        singles = set()
+        if extra:
+            idx, sh = extra
+            types.add(sh)
+            if sh & 0x7f == SIGHASH_SINGLE:
+                singles.add(idx)
 
-        # sighash regardless of ANYONECANPAY input part
-        out_sighash_type = sighash_type & 0x7f
+        for idx, inp in enumerate(self.inputs):
+            if not inp.is_segwit or inp.fully_signed:
+                continue
 
-        if self.hashPrevouts and sighash_type == SIGHASH_ALL:
-            hashPrevouts = self.hashPrevouts
-            hashSequence = self.hashSequence
-            hashOutputs = self.hashOutputs
-        else:
-            # input side
-            hashPrevouts = sha256()
-            hashSequence = sha256()
+            sh = SIGHASH_ALL if inp.sighash is None else inp.sighash
+            types.add(sh)
+
+            if sh & 0x7f == SIGHASH_SINGLE:
+                # missing output is blocked later, when signing
+                singles.add(idx)
 
-            if not (sighash_type & SIGHASH_ANYONECANPAY):
+        if any(not (sh & SIGHASH_ANYONECANPAY) for sh in types):
+            # input side
+            if prevouts is None:
+                prevouts = sha256()
+                sequences = sha256()
                 for in_idx, txi in self.input_iter():
-                    hashPrevouts.update(txi.prevout.serialize())
-                    if out_sighash_type == SIGHASH_ALL:
-                        hashSequence.update(pack("<I", txi.nSequence))
+                    prevouts.update(txi.prevout.serialize())
+                    sequences.update(pack("<I", txi.nSequence))
 
-                hashPrevouts = ngu.hash.sha256s(hashPrevouts.digest())
-                if out_sighash_type == SIGHASH_ALL:
-                    hashSequence = ngu.hash.sha256s(hashSequence.digest())
+            self.hashPrevouts = ngu.hash.sha256s(prevouts.digest())
+            self.hashSequence = ngu.hash.sha256s(sequences.digest())
 
-            # output side
-            hashOutputs = sha256()
-            if out_sighash_type == SIGHASH_ALL:
-                for out_idx, txo in self.output_iter():
-                    hashOutputs.update(txo.serialize())
+        # output side: one pass, for all types
+        want_all = any(sh & 0x7f == SIGHASH_ALL for sh in types)
+        self.hash_single = {}
+        if want_all or singles:
+            outputs = sha256()
+            for out_idx, txo in self.output_iter():
+                ser = txo.serialize()
+                if want_all:
+                    outputs.update(ser)
+                if out_idx in singles:
+                    self.hash_single[out_idx] = ngu.hash.sha256d(ser)
 
-                hashOutputs = ngu.hash.sha256s(hashOutputs.digest())
+            if want_all:
+                self.hashOutputs = ngu.hash.sha256s(outputs.digest())
 
-            elif out_sighash_type == SIGHASH_SINGLE:
-                # Even though below case is consensus valid, we block it.
-                # If users do not want to sign any outputs, NONE sighash flag
-                # should be used instead.
-                assert replace_idx < self.num_outputs, \
-                            "SINGLE corresponding output (%d) missing" % replace_idx
+        gc.collect()
 
-                for out_idx, txo in self.output_iter():
-                    if out_idx == replace_idx:
-                        hashOutputs = ngu.hash.sha256d(txo.serialize())
-            else:
-                assert out_sighash_type == SIGHASH_NONE
+    def make_txn_segwit_sighash(self, replace_idx, replacement, amount, scriptCode, sighash_type):
+        # Implement BIP 143 hashing algo for signature of segwit programs.
+        # see <https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki>
+        #
+        # sighash regardless of ANYONECANPAY input part
+        out_sighash_type = sighash_type & 0x7f
+        anyone = sighash_type & SIGHASH_ANYONECANPAY
+
+        if out_sighash_type == SIGHASH_SINGLE:
+            # Even though below case is consensus valid, we block it.
+            # If users do not want to sign any outputs, NONE sighash flag
+            # should be used instead.
+            assert replace_idx < self.num_outputs, \
+                        "SINGLE corresponding output (%d) missing" % replace_idx
+
+        if (not anyone and self.hashPrevouts is None) \
+                or (out_sighash_type == SIGHASH_ALL and self.hashOutputs is None) \
+                or (out_sighash_type == SIGHASH_SINGLE
+                        and replace_idx not in (self.hash_single or ())):
+            # normally done in consider_inputs, but not if caller skipped that
+            fd = self.fd
+            old_pos = fd.tell()
+            self.calc_segwit_hashes(extra=(replace_idx, sighash_type))
+            fd.seek(old_pos)
 
-            if sighash_type == SIGHASH_ALL:
-                # cache this multitude of hashes
-                self.hashPrevouts = hashPrevouts
-                self.hashSequence = hashSequence
-                self.hashOutputs = hashOutputs
+        # input side
+        hashPrevouts = hashSequence = bytes(32)
+        if not anyone:
+            hashPrevouts = self.hashPrevouts
+            if out_sighash_type == SIGHASH_ALL:
+                hashSequence = self.hashSequence
 
-            gc.collect()
+        # output side
+        if out_sighash_type == SIGHASH_ALL:
+            hashOutputs = self.hashOutputs
+        elif out_sighash_type == SIGHASH_SINGLE:
+            hashOutputs = self.hash_single[replace_idx]
+        else:
+            assert out_sighash_type == SIGHASH_NONE
+            hashOutputs = bytes(32)
 
         rv = sha256()
 
         # version number
         rv.update(pack('<i', self.txn_version))       # nVersion
-        rv.update(hashPrevouts if isinstance(hashPrevouts, bytes) else bytes(32))
-        rv.update(hashSequence if isinstance(hashSequence, bytes) else bytes(32))
+        rv.update(hashPrevouts)
+        rv.update(hashSequence)
 
         rv.update(replacement.prevout.serialize())
 
@@ -1809,13 +1988,11 @@ class psbtObject(psbtProxy):
         rv.update(pack("<q", amount))
         rv.update(pack("<I", replacement.nSequence))
 
-        rv.update(hashOutputs if isinstance(hashOutputs, bytes) else bytes(32))
+        rv.update(hashOutputs)
 
         # locktime, sighash_type
         rv.update(pack('<II', self.lock_time, sighash_type))
 
-        fd.seek(old_pos)
-
         # double SHA256
         return ngu.hash.sha256s(rv.digest())
 
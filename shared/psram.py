@@ -17,6 +17,12 @@ class PSRAMWrapper:
         # one-copy byte-wise access
         return uctypes.bytes_at(self.base+offset, ln)
 
+    def mapped(self, offset, ln):
+        # zero-copy access; treat as read-only
+        assert offset + ln <= self.length, (offset+ln)
+
+        return memoryview(self._wr)[offset:offset+ln]
+
     def write_at(self, offset, ln):
         # word-aligned writes only
         assert offset % 4 == 0, offset
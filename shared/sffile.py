@@ -148,12 +148,26 @@ class SFFile:
             # Mk4: memory-mapped, but can only do word-aligned writes
             self.checksum.update(b)
 
-            self.runt.extend(b)
-            here = ALIGN4(len(self.runt))
-            if here:
-                PSRAM.write(self.start + self._pos, self.runt[0:here])
-                self._pos += here
-                self.runt = self.runt[here:]
+            mv = memoryview(b)
+            if self.runt:
+                # complete the partial word left over from last time
+                take = min(4 - len(self.runt), left)
+                self.runt.extend(mv[0:take])
+                mv = mv[take:]
+
+                if len(self.runt) == 4:
+                    PSRAM.write(self.start + self._pos, self.runt)
+                    self._pos += 4
+                    self.runt = bytearray()
+
+            if not self.runt:
+                # bulk of the data goes directly to PSRAM, without copies
+                here = ALIGN4(len(mv))
+                if here:
+                    PSRAM.write(self.start + self._pos, mv[0:here])
+                    self._pos += here
+
+                self.runt.extend(mv[here:])
 
 
             self.pos += left
@@ -237,6 +251,48 @@ class SFFile:
         return actual
 
 
+class PSRAMFile(SFFile):
+    # Read-only file, already in PSRAM (Mk4 only), which is memory-mapped.
+    # - read() makes a single copy, instead of two
+    # - readinto() and view() allocate nothing (beyond a memoryview)
+    def __init__(self, start, length, message=None):
+        super().__init__(start, length=length, message=message)
+        self.mem = PSRAM.mapped(start, length)
+
+    def read(self, ll=None):
+        if ll is None:
+            ll = self.length - self.pos
+        else:
+            ll = min(ll, self.length - self.pos)
+
+        if ll <= 0:
+            # at EOF
+            return b''
+
+        rv = PSRAM.read_at(self.start + self.pos, ll)
+        self.pos += ll
+
+        return rv
+
+    def view(self, ll):
+        # like read() but returns a memoryview into PSRAM: no copy at all
+        ll = min(ll, self.length - self.pos)
+        rv = self.mem[self.pos:self.pos+ll]
+        self.pos += ll
+
+        return rv
+
+    def readinto(self, b):
+        actual = min(self.length - self.pos, len(b))
+        if actual <= 0:
+            return 0
+
+        b[0:actual] = self.mem[self.pos:self.pos+actual]
+        self.pos += actual
+
+        return actual
+
+
 class SizerFile(SFFile):
     # looks like a file, but forgets everything except file position
     # - used to measure length of an output
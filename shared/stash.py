@@ -133,6 +133,9 @@ bip39_passphrase = ''
 CACHE_CHECK_RATE = const(10*1000)   # 10 seconds
 CACHE_MAX_LIFE = const(60*1000)     # one minute
 
+# max number of intermediate BIP-32 nodes held by derive_path, per SensitiveValues
+DERIV_CACHE_SIZE = const(8)
+
 class SensitiveValues:
     # be a context manager, and holder of secrets in-memory
 
@@ -141,9 +144,16 @@ class SensitiveValues:
     _cache_secret = None
     _cache_used = None
 
+    # derive_path() cache statistics, over all instances (see simulator)
+    deriv_hits = 0
+    deriv_misses = 0
+
     def __init__(self, secret=None, bypass_pw=False):
         self.spots = []
 
+        # parent nodes of paths we've derived: key is tuple of path components
+        self._deriv_cache = {}
+
         # backup during volatile bip39 encryption: do not use passphrase
         self._bip39pw = '' if bypass_pw else str(bip39_passphrase)
 
@@ -270,6 +280,10 @@ class SensitiveValues:
         # just in case this holds some pointers?
         del self.spots
 
+        for n in self._deriv_cache.values():
+            blank_object(n)
+        self._deriv_cache.clear()
+
         # .. and some GC will help too!
         gc.collect()
 
@@ -314,28 +328,77 @@ class SensitiveValues:
 
     def derive_path(self, path, master=None, register=True):
         # Given a string path, derive the related subkey
-        rv = (master or self.node).copy()
-
-        if register:
-            self.register(rv)
-
+        # - when working from our master, the parent of the result is cached (until
+        #   we exit) so deriving siblings, like .../0/{0..N}, is a single step each
+        # - see _deriv_cached()
+        parts = []
         for i in path.split('/'):
             if i == 'm': continue
             if not i: continue      # trailing or duplicated slashes
 
             if i[-1] in "h'":
                 assert len(i) >= 2
-                is_hard = True
                 here = int(i[:-1])
+                assert 0 <= here < 0x80000000
+                here |= 0x80000000
             else:
                 here = int(i)
-                is_hard = False
+                assert 0 <= here < 0x80000000
+
+            parts.append(here)
 
-            assert 0 <= here < 0x80000000
-            rv.derive(here, is_hard)
+        prefix = tuple(parts[:-1])
+
+        if master or not prefix:
+            rv = (master or self.node).copy()
+            todo = parts
+        else:
+            parent = self._deriv_cache.get(prefix)
+            if parent is not None:
+                SensitiveValues.deriv_hits += 1
+            else:
+                SensitiveValues.deriv_misses += 1
+                parent = self._deriv_cached(prefix)
+
+            rv = parent.copy()
+            todo = parts[-1:]
+
+        if register:
+            self.register(rv)
+
+        for here in todo:
+            rv.derive(here & 0x7fffffff, bool(here & 0x80000000))
 
         return rv
 
+    def _deriv_cached(self, prefix):
+        # derive node at prefix from our master, and remember it
+        # - account level (first 3 parts, if all hardened) is cached along the
+        #   way, so other branches under same account are cheap too
+        # - cached nodes are ours: blanked on eviction or exit, not put into spots
+        acct = prefix[:3]
+        if len(prefix) > 3 and all(i & 0x80000000 for i in acct):
+            node = self._deriv_cache.get(acct)
+            if node is None:
+                node = self._deriv_cached(acct)
+            node = node.copy()
+            todo = prefix[3:]
+        else:
+            node = self.node.copy()
+            todo = prefix
+
+        for here in todo:
+            node.derive(here & 0x7fffffff, bool(here & 0x80000000))
+
+        if len(self._deriv_cache) >= DERIV_CACHE_SIZE:
+            # make room for one
+            _, old = self._deriv_cache.popitem()
+            blank_object(old)
+
+        self._deriv_cache[prefix] = node
+
+        return node
+
     def duress_root(self):
         # Return a bip32 node for the duress wallet linked to this wallet.
         # 0x80000000 - 0xCC10 = 2147431408
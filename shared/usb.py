@@ -2,7 +2,7 @@
 #
 # usb.py - USB related things
 #
-import ckcc, pyb, callgate, sys, ux, ngu, stash, aes256ctr
+import ckcc, pyb, callgate, sys, ux, ngu, stash, aes256ctr, gc, utime
 from uasyncio import sleep_ms, core
 from uhashlib import sha256
 from public_constants import MAX_MSG_LEN, MAX_BLK_LEN, AFC_SCRIPT
@@ -48,10 +48,12 @@ hid_descp = bytes([
 HSM_WHITELIST = frozenset({
     'logo', 'ping', 'vers',     # harmless/boring
     'upld', 'sha2', 'dwld', 'stxn',     # up/download/sign PSBT needed
+    'blku', 'blkd',                     # same, but bulk transfers
     'mitm', 'ncry',             # maybe limited by policy tho
     'smsg',                     # limited by policy
     'blkc', 'hsts',             # report status values
     'stok', 'smok',             # completion check: sign txn or msg
+    'bupl', 'bstx', 'bsok', 'bdwl',     # batch signing of PSBT (Mk4)
     'xpub', 'msck',             # quick status checks
     'p2sh', 'show',             # limited by HSM policy
     'user',                     # auth HSM user, other user cmds not allowed
@@ -126,6 +128,9 @@ class USBHandler:
         self.file_checksum = sha256()
         self.is_fw_upgrade = False
 
+        # reply for first problem seen during a bulk upload, sent after last block
+        self.bulk_error = None
+
         # handle simulator
         self.blockable = getattr(self.dev, 'pipe', self.dev)
 
@@ -133,6 +138,16 @@ class USBHandler:
         self.msg = usb_buf
         assert len(self.msg) == MAX_MSG_LEN
 
+        # one packet, each way; reused. Data part (63 bytes) can be used w/o a slice
+        self.rx = bytearray(64)
+        self.rx_body = memoryview(self.rx)[1:]
+        self.tx = bytearray(64)
+        self.tx_body = memoryview(self.tx)[1:]
+
+        # counters, see stats()
+        self.count_heap = is_simulator()
+        self.stats(reset=True)
+
         self.encrypted_req = False
 
         # not bound to a specific crypto setup by default
@@ -142,27 +157,40 @@ class USBHandler:
         self.encrypt = None
         self.decrypt = None
 
+    def stats(self, reset=False):
+        # packet counts, rate, and heap used by framing (simulator only)
+        now = utime.ticks_ms()
+        if reset:
+            self.rx_packets = self.tx_packets = self.framing_heap = 0
+            self.stats_start = now
+            return
+
+        secs = max(utime.ticks_diff(now, self.stats_start), 1) / 1000
+        return dict(rx_packets=self.rx_packets, tx_packets=self.tx_packets,
+                        rx_rate=self.rx_packets / secs, tx_rate=self.tx_packets / secs,
+                        framing_heap=self.framing_heap)
+
     def get_packet(self):
-        # read next packet (64 bytes) waiting on the wire. Unframe it and return
-        # active part of packet, flags associated.
-        buf = self.dev.recv(64, timeout=5000)
+        # read next packet (64 bytes) waiting on the wire, into self.rx. Unframe it
+        # and return length of active part (at self.rx_body), flags associated.
+        got = self.dev.recv(self.rx, timeout=5000)
         ckcc.usb_active()
 
-        if not buf:
+        if not got:
             raise FramingError('timeout')
-        elif len(buf) < 64:
+        elif got < 64:
             raise FramingError('short')
-        elif len(buf) > 64:
-            raise FramingError('long')
+
+        self.rx_packets += 1
 
         # first byte gives us the actual size, status
         # all illegal combos here may become special messages someday
-        flag = buf[0]
+        flag = self.rx[0]
         is_last  = bool(flag & 0x80)
         len_here = int(flag & 0x3f)
         is_encrypted = bool(flag & 0x40)
 
-        return buf[1:1+len_here], is_last, is_encrypted
+        return len_here, is_last, is_encrypted
 
     async def usb_hid_recv(self):
         # blocks and builds up a full-length command packet in memory
@@ -173,16 +201,23 @@ class USBHandler:
             yield core._io_queue.queue_read(self.blockable)
 
             try:
-                here, is_last, is_encrypted = self.get_packet()
+                if self.count_heap:
+                    before = gc.mem_alloc()
+
+                lh, is_last, is_encrypted = self.get_packet()
 
-                #print('Rx[%d]' % len(here))
-                if here:
-                    lh = len(here)
+                #print('Rx[%d]' % lh)
+                if lh:
                     if msg_len+lh > MAX_MSG_LEN:
                         raise FramingError('xlong')
 
-                    self.msg[msg_len:msg_len + lh] = here
+                    # reassemble directly into usb_buf
+                    self.msg[msg_len:msg_len + lh] = \
+                            self.rx_body if lh == 63 else self.rx_body[0:lh]
                     msg_len += lh
+
+                    if self.count_heap:
+                        self.framing_heap += max(0, gc.mem_alloc() - before)
                 else:
                     # treat zero-length packets as a reset request
                     # do not echo anything back on link.. used to resync connection
@@ -246,8 +281,9 @@ class USBHandler:
                     resp = b'err_Confused ' + problem_file_line(exc)
                     msg_len = 0
 
-                # aways send a reply if they get this far
-                await self.send_response(resp)
+                # aways send a reply if they get this far (except mid-way thru bulk upload)
+                if resp is not False:
+                    await self.send_response(resp)
 
             except FramingError as exc:
                 reason = exc.args[0]
@@ -262,15 +298,8 @@ class USBHandler:
                 msg_len = 0
 
     def decrypt_inplace(self, msg_len):
-        # self.msg is encrypted. decode it in place
-        # - seems dangerous to use memview here, but works
-        # - some memory alloc still happens here tho
-        self.msg[0:msg_len] = self.decrypt(memoryview(self.msg)[0:msg_len])
-
-    def encrypt_response(self, msg):
-        # encrypt what we'll send to desktop
-
-        return self.encrypt(msg)
+        # self.msg is encrypted. decode it in place, no copy made
+        self.decrypt(memoryview(self.msg)[0:msg_len])
 
     async def send_response(self, resp):
         # send a python object as the response
@@ -293,10 +322,12 @@ class USBHandler:
 
         assert len(resp) >= 4
 
-        msg = bytearray(64)
+        # packets are built, and encrypted, one at a time in self.tx
+        msg = self.tx
+        resp = memoryview(resp)
+        encrypt = self.encrypt if self.encrypted_req else None
 
-        if self.encrypt and self.encrypted_req:
-            resp = self.encrypt_response(resp)
+        if encrypt:
             final_flag = 0x80 | 0x40
         else:
             final_flag = 0x80
@@ -304,10 +335,17 @@ class USBHandler:
         pos = 0
         left = len(resp)
         while left:
+            if self.count_heap:
+                before = gc.mem_alloc()
+
             # sent up to 63 bytes per packet
             here = min(left, 63)
+            body = self.tx_body if here == 63 else self.tx_body[0:here]
             msg[0] = here
-            msg[1:1+here] = resp[pos:pos+here]
+            body[:] = resp[pos:pos+here]
+            if encrypt:
+                encrypt(body)
+
             if here == left:
                 # no more to come
                 assert 0 <= here < 64
@@ -316,6 +354,11 @@ class USBHandler:
             left -= here
             pos += here
 
+            if self.count_heap:
+                self.framing_heap += max(0, gc.mem_alloc() - before)
+
+            self.tx_packets += 1
+
             ckcc.usb_active()
             for retries in range(100):
                 chk = self.dev.send(msg)
@@ -324,8 +367,9 @@ class USBHandler:
                 # Host may not have read previous value yet, so might need
                 # to wait for it. Data loss possible here, but also the
                 # host may stop reading the EP forever, so not our fault.
-                # Let other stuff run during this delay.
-                await sleep_ms(10)
+                # Let other stuff run during this delay. Short waits at first,
+                # because during bulk downloads host is reading steadily.
+                await sleep_ms(1 if retries < 20 else 10)
 
     def framing_error(self, why):
         # send error about framing, and recover
@@ -392,6 +436,41 @@ class USBHandler:
             offset, length, fileno = unpack_from('<III', args)
             return await self.handle_download(offset, length, fileno)
 
+        if cmd == 'blku':
+            # bulk upload: same as upld, but host doesn't wait for a reply per block,
+            # only the last block gets one: the checksum over whole file (or first error)
+            offset, total_size = unpack_from('<II', args)
+            data = memoryview(args)[4+4:]
+
+            if offset == 0:
+                self.bulk_error = None
+
+            if not self.bulk_error:
+                # any problem: stop writing, and report it after the last block
+                try:
+                    await self.handle_upload(offset, total_size, data)
+                except CCBusyError:
+                    self.bulk_error = b'busy'
+                except (ValueError, AssertionError) as exc:
+                    msg = str(exc) or ('Assertion ' + problem_file_line(exc))
+                    self.bulk_error = b'err_' + msg.encode()[0:80]
+                except Exception as exc:
+                    msg = str(exc) or problem_file_line(exc)
+                    self.bulk_error = b'err_' + msg.encode()[0:80]
+
+            if offset+len(data) < total_size:
+                return False
+
+            if self.bulk_error:
+                return self.bulk_error
+
+            return b'biny' + self.file_checksum.digest()
+
+        if cmd == 'blkd':
+            # bulk download: stream whole range as a series of replies
+            offset, length, fileno = unpack_from('<III', args)
+            return await self.handle_bulk_download(offset, length, fileno)
+
         if cmd == 'ncry':
             version, his_pubkey = unpack_from('<I64s', args)
 
@@ -505,6 +584,46 @@ class USBHandler:
             sign_transaction(txn_len, (flags & STXN_FLAGS_MASK), txn_sha)
             return None
 
+        if cmd in ('bupl', 'bstx', 'bsok', 'bdwl'):
+            # pipelined signing of many PSBT, using slots in PSRAM
+            assert hsm_active and has_psram, 'batch needs HSM'
+            from auth import BatchSigner
+            batch = BatchSigner.get()
+            slot = args[0]
+            assert slot < len(batch.slots), 'bad slot'
+
+            if cmd in ('bupl', 'bstx'):
+                # slots overlap the PSRAM used by upld/stxn: don't trash a PSBT being
+                # signed there, or its result before host has collected it
+                from auth import UserAuthorizedAction, ApproveTransaction
+                if isinstance(UserAuthorizedAction.active_request, ApproveTransaction):
+                    raise CCBusyError
+
+            if cmd == 'bupl':
+                offset, total_size = unpack_from('<II', args, 1)
+                return self.handle_batch_upload(batch, slot, offset, total_size,
+                                                    memoryview(args)[1+4+4:])
+
+            if cmd == 'bdwl':
+                offset, length = unpack_from('<II', args, 1)
+                return self.handle_batch_download(slot, offset, length)
+
+            if cmd == 'bstx':
+                txn_len, flags, txn_sha = unpack_from('<II32s', args, 1)
+                chk = batch.checksums[slot]
+                if not chk or txn_sha != chk.digest():
+                    return b'err_Checksum'
+
+                batch.start(slot, txn_len, (flags & STXN_FLAGS_MASK), txn_sha)
+                return None
+
+            # bsok: is that slot done?
+            rv = batch.result(slot)
+            if isinstance(rv, tuple):
+                resp_len, sha = rv
+                return pack('<4sI32s', 'strx', resp_len, sha)
+            return rv
+
         if cmd == 'stok' or cmd == 'bkok' or cmd == 'smok' or cmd == 'pwok':
             # Have we finished (whatever) the transaction,
             # which needed user approval? If so, provide result.
@@ -673,8 +792,8 @@ class USBHandler:
         # Would be nice to have nonce in addition to the counter, but
         # harder on the desktop side.
         ctr = aes256ctr.new(self.session_key)
-        self.encrypt = ctr.cipher
-        self.decrypt = ctr.copy().cipher
+        self.encrypt = ctr.cipher_inplace
+        self.decrypt = ctr.copy().cipher_inplace
 
         from glob import settings
         xfp = settings.get('xfp', 0)
@@ -733,6 +852,21 @@ class USBHandler:
 
         return resp
 
+    async def handle_bulk_download(self, offset, length, file_number):
+        # send many 'dwld' responses without waiting for requests
+        # - host gets checksum with 'sha2' at end, as with normal download
+        assert 1 <= length and offset+length <= MAX_TXN_LEN, 'len'
+
+        end = offset + length
+        while 1:
+            here = min(MAX_BLK_LEN, end - offset)
+            resp = await self.handle_download(offset, here, file_number)
+            offset += here
+            if offset >= end:
+                return resp
+
+            await self.send_response(resp)
+
     async def handle_upload(self, offset, total_size, data):
         if has_psram:
             from glob import PSRAM
@@ -756,6 +890,12 @@ class USBHandler:
             if offset == 0:
                 assert data[0:5] == b'psbt\xff', 'psbt'
 
+            if has_psram:
+                # batch signing uses the same PSRAM
+                from auth import BatchSigner
+                if BatchSigner.active and BatchSigner.active.busy:
+                    raise CCBusyError
+
         for pos in range(offset, offset+len(data), 256):
             if pos % 4096 == 0:
                 dis.fullscreen("Receiving...", offset/total_size)
@@ -819,6 +959,42 @@ class USBHandler:
 
         return offset
 
+    def handle_batch_upload(self, batch, slot, offset, total_size, data):
+        # upload a PSBT into input file of a batch slot (always PSRAM)
+        from glob import PSRAM
+        from auth import BATCH_SLOT_LEN, batch_slot_offsets
+
+        base, _ = batch_slot_offsets(slot)
+        assert batch.can_upload(slot), 'slot busy'
+        assert offset % 256 == 0, 'alignment'
+        assert offset+len(data) <= total_size <= BATCH_SLOT_LEN, 'long'
+
+        if offset == 0:
+            assert data[0:5] == b'psbt\xff', 'psbt'
+            batch.checksums[slot] = sha256()
+
+        assert batch.checksums[slot], 'order'
+        batch.checksums[slot].update(data)
+        PSRAM.write(base + offset, data)
+
+        return offset
+
+    def handle_batch_download(self, slot, offset, length):
+        # read back the output file of a batch slot
+        from glob import PSRAM
+        from auth import BATCH_SLOT_LEN, batch_slot_offsets
+
+        _, base = batch_slot_offsets(slot)
+        assert 0 <= offset < BATCH_SLOT_LEN, "bad offset"
+        length = min(length, MAX_BLK_LEN, BATCH_SLOT_LEN - offset)
+        assert 1 <= length, 'len'
+
+        resp = bytearray(4 + length)
+        resp[0:4] = b'biny'
+        PSRAM.read(base + offset, memoryview(resp)[4:])
+
+        return resp
+
     def handle_xpub(self, subpath):
         # Share the xpub for the indicated subpath. Expects
         # a text string which is the path derivation.
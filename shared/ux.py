@@ -167,6 +167,136 @@ class PressRelease:
 # (using FontSmall)
 CH_PER_W = const(17)
 
+class StoryPager:
+    # word-wrap a story lazily: source lines are indexed (by offset) as we
+    # scroll into them, and only those near the window are ever wrapped.
+    # - accepts a stream (with seek/tell) or string
+    # - trailing blank lines are dropped, 'EOT' follows the last line
+    def __init__(self, msg, title=None):
+        self.msg = msg
+        self.is_stream = hasattr(msg, 'readline')
+        self.title = title
+
+        if self.is_stream:
+            msg.seek(0, 2)
+            self.size = msg.tell()
+        else:
+            self.size = len(msg)
+
+        self.offsets = [-1] if title else []      # start of each source line
+        self.pending = []       # blank lines, not yet known to be followed by text
+        self.scan = 0           # offset of next source line to be indexed
+        self.eof = False
+        self.cache = {}         # source line number => wrapped lines
+
+        # position of top of screen: source line, and line within its wrapping
+        self.n = 0
+        self.k = 0
+
+    def read_at(self, off):
+        # source line starting at offset, and offset of following line; None at end
+        if self.is_stream:
+            self.msg.seek(off)
+            ln = self.msg.readline()
+            if not ln:
+                return None
+            nxt = self.msg.tell()
+            if ln[-1] == '\n':
+                ln = ln[:-1]
+            return ln, nxt
+
+        if off >= self.size:
+            return None
+        e = self.msg.find('\n', off)
+        if e < 0:
+            e = self.size
+        return self.msg[off:e], e+1
+
+    def has(self, n):
+        # is there a (non-trailing-blank) source line #n? indexes only as far as needed
+        while len(self.offsets) <= n and not self.eof:
+            r = self.read_at(self.scan)
+            if r is None:
+                self.eof = True
+                self.pending = []
+                break
+
+            if r[0]:
+                self.offsets.extend(self.pending)
+                self.offsets.append(self.scan)
+                self.pending = []
+            else:
+                self.pending.append(self.scan)
+
+            self.scan = r[1]
+
+        return n < len(self.offsets)
+
+    def wrapped(self, n):
+        rv = self.cache.get(n)
+        if rv is None:
+            off = self.offsets[n]
+            if off < 0:
+                # kinda weak rendering but it works.
+                rv = ['\x01' + self.title]
+            else:
+                ln = self.read_at(off)[0]
+                # ok if empty string, just a blank line
+                rv = list(word_wrap(ln, CH_PER_W)) if len(ln) > CH_PER_W else [ln]
+            self.cache[n] = rv
+        return rv
+
+    def down(self):
+        # returns False if already showing last line at top
+        if not self.has(self.n):
+            return False
+        if self.k+1 < len(self.wrapped(self.n)):
+            self.k += 1
+        elif self.has(self.n+1):
+            self.n += 1
+            self.k = 0
+        else:
+            return False
+        return True
+
+    def up(self):
+        if self.k:
+            self.k -= 1
+        elif self.n:
+            self.n -= 1
+            self.k = len(self.wrapped(self.n)) - 1
+        else:
+            return False
+        return True
+
+    def top(self):
+        self.n = self.k = 0
+
+    def window(self, H):
+        # lines to be shown, starting at current position; wraps only what is needed
+        rv = []
+        n, k = self.n, self.k
+        while len(rv) < H:
+            if not self.has(n):
+                rv.append('EOT')
+                break
+            w = self.wrapped(n)
+            rv.extend(w[k:k+H-len(rv)])
+            n += 1
+            k = 0
+
+        # forget wrapping of lines well outside the window
+        for i in [i for i in self.cache if i < self.n-H or i > n]:
+            del self.cache[i]
+
+        return rv
+
+    def fraction(self):
+        # for scroll bar: based on position within source
+        if not self.size or not self.offsets:
+            return 0
+        return max(0, self.offsets[self.n]) / self.size
+
 async def ux_show_story(msg, title=None, escape=None, sensitive=False, strict_escape=False):
     # show a big long string, and wait for XY to continue
     # - returns character used to get out (X or Y)
@@ -175,87 +305,60 @@ async def ux_show_story(msg, title=None, escape=None, sensitive=False, strict_es
     from glob import dis, numpad
     from display import FontLarge
 
-    lines = []
-    if title:
-        # kinda weak rendering but it works.
-        lines.append('\x01' + title)
-
-    if hasattr(msg, 'readline'):
-        msg.seek(0)
-        for ln in msg:
-            if ln[-1] == '\n': 
-                ln = ln[:-1]
-
-            if len(ln) > CH_PER_W:
-                lines.extend(word_wrap(ln, CH_PER_W))
-            else:
-                # ok if empty string, just a blank line
-                lines.append(ln)
+    story = StoryPager(msg, title)
 
-        # no longer needed & rude to our caller, but let's save the memory
-        msg.close()
-        del msg
-        gc.collect()
-    else:
-        for ln in msg.split('\n'):
-            if len(ln) > CH_PER_W:
-                lines.extend(word_wrap(ln, CH_PER_W))
-            else:
-                # ok if empty string, just a blank line
-                lines.append(ln)
-
-    # trim blank lines at end, add our own marker
-    while not lines[-1]:
-        lines = lines[:-1]
-
-    lines.append('EOT')
-
-    top = 0
     H = 5
     ch = None
     pr = PressRelease()
-    while 1:
-        # redraw
-        dis.clear()
-
-        y=0
-        for ln in lines[top:top+H]:
-            if ln == 'EOT':
-                dis.hline(y+3)
-            elif ln and ln[0] == '\x01':
-                dis.text(0, y, ln[1:], FontLarge)
-                y += 21
-            else:
-                dis.text(0, y, ln)
+    try:
+        while 1:
+            # redraw
+            dis.clear()
+
+            y=0
+            for ln in story.window(H):
+                if ln == 'EOT':
+                    dis.hline(y+3)
+                elif ln and ln[0] == '\x01':
+                    dis.text(0, y, ln[1:], FontLarge)
+                    y += 21
+                else:
+                    dis.text(0, y, ln)
 
-                if sensitive and len(ln) > 3 and ln[2] == ':':
-                    dis.mark_sensitive(y, y+13)
+                    if sensitive and len(ln) > 3 and ln[2] == ':':
+                        dis.mark_sensitive(y, y+13)
 
-                y += 13
+                    y += 13
 
-        dis.scroll_bar(top / len(lines))
-        dis.show()
+            dis.scroll_bar(story.fraction())
+            dis.show()
 
-        # wait to do something
-        ch = await pr.wait()
-        if escape and (ch == escape or ch in escape):
-            # allow another way out for some usages
-            return ch
-        elif ch in 'xy':
-            if not strict_escape:
+            # wait to do something
+            ch = await pr.wait()
+            if escape and (ch == escape or ch in escape):
+                # allow another way out for some usages
                 return ch
-        elif ch == '0':
-            top = 0
-        elif ch == '7':     # page up
-            top = max(0, top-H)
-        elif ch == '9':     # page dn
-            top = min(len(lines)-2, top+H)
-        elif ch == '5':     # scroll up
-            top = max(0, top-1)
-        elif ch == '8':     # scroll dn
-            top = min(len(lines)-2, top+1)
-
-        
+            elif ch in 'xy':
+                if not strict_escape:
+                    return ch
+            elif ch == '0':
+                story.top()
+            elif ch == '7':     # page up
+                for i in range(H):
+                    if not story.up(): break
+            elif ch == '9':     # page dn
+                for i in range(H):
+                    if not story.down(): break
+            elif ch == '5':     # scroll up
+                story.up()
+            elif ch == '8':     # scroll dn
+                story.down()
+    finally:
+        # no longer needed & rude to our caller, but let's save the memory
+        if story.is_stream:
+            msg.close()
+        del msg, story
+        gc.collect()
 
 async def idle_logout():
     import glob
@@ -0,0 +1,289 @@
+# (c) Copyright 2026 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# Benchmarks for PSBT signing on the simulator. Not run by default (not named test_*).
+#
+#   pytest bench_sign.py                        # results => debug/bench-sign.json
+#   python bench_sign.py old.json new.json      # compare two runs
+#
+# For each shape of transaction, measures time (microseconds) spent in each phase of
+# signing: parse, validate, approve, sign, serialize; plus heap used. See
+# devtest/bench_psbt.py for the part that runs inside the simulator.
+#
+# Also micro benchmarks: microseconds per call, for some smaller parts of the system.
+#
+import pytest, os, json, time, struct, subprocess
+from io import BytesIO
+from struct import pack
+from txn import *
+
+RESULTS_FILE = 'debug/bench-sign.json'
+PHASES = ['parse', 'validate', 'approve', 'sign', 'serialize']
+
+# (num_ins, num_outs)
+SIZES = [(1, 1), (10, 10), (100, 2), (250, 2), (2, 500), (2, 2000)]
+
+@pytest.fixture(scope='module')
+def bench_results(sim_exec):
+    # collect results of whole module, and write them out at the end
+    try:
+        rev = subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                        stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        rev = None
+
+    rv = dict(git=rev, when=time.strftime('%Y-%m-%d %H:%M:%S'), results={}, micro={})
+
+    yield rv
+
+    with open(RESULTS_FILE, 'wt') as fd:
+        json.dump(rv, fd, indent=2, sort_keys=True)
+    print("Wrote: " + RESULTS_FILE)
+
+@pytest.fixture
+def run_bench(sim_exec, bench_results):
+    # run the phases in the simulator, and record results under name
+    def doit(name, psbt, finalize=False):
+        fname = 'debug/bench.psbt'
+        open(fname, 'wb').write(psbt)
+
+        sim_exec('import main; main.FILENAME = %r; main.FINALIZE = %r'
+                                    % ('../../testing/' + fname, finalize))
+        resp = sim_exec('execfile("%s")' % os.path.realpath('devtest/bench_psbt.py'))
+        assert 'Traceback' not in resp, resp
+
+        rv = json.loads(resp)
+        rv['total'] = sum(rv[p] for p in PHASES)
+        bench_results['results'][name] = rv
+
+        print('%-32s %s  heap=%d' % (name,
+                    ' '.join('%s=%.1fms' % (p, rv[p]/1000) for p in PHASES), rv['peak_heap']))
+        return rv
+
+    return doit
+
+@pytest.fixture
+def micro_bench(sim_exec, bench_results):
+    # time some code in the simulator: setup once, then body count times
+    # - returns microseconds per run of body
+    def doit(name, setup, body, count=1):
+        cmd = setup + '\nimport utime\nt0 = utime.ticks_us()\nfor _ in range(%d):\n' % count
+        cmd += ''.join('    %s\n' % ln for ln in body.strip('\n').split('\n'))
+        cmd += 'RV.write(str(utime.ticks_diff(utime.ticks_us(), t0)))\n'
+
+        resp = sim_exec(cmd)
+        assert 'Traceback' not in resp, resp
+
+        rv = int(resp) / count
+        bench_results['micro'][name] = rv
+        print('%-40s %10.1f us' % (name, rv))
+
+        return rv
+
+    return doit
+
+def segwit_hacker(wrapped=False, full_utxo=False):
+    # modify fake_txn's p2wpkh inputs: wrap in p2sh, and/or add non-witness UTXO
+    from pycoin.tx.Tx import Tx
+    from pycoin.tx.TxIn import TxIn
+    from pycoin.tx.TxOut import TxOut
+    from pycoin.encoding import hash160
+
+    def streamed(obj):
+        with BytesIO() as fd:
+            obj.stream(fd)
+            return fd.getvalue()
+
+    def doit(psbt):
+        t = Tx.from_bin(psbt.txn)
+        for i, inp in enumerate(psbt.inputs):
+            value, = struct.unpack('<q', inp.witness_utxo[0:8])
+            scr = inp.witness_utxo[9:]
+            if wrapped:
+                inp.redeem_script = scr
+                scr = bytes([0xa9, 0x14]) + hash160(scr) + bytes([0x87])
+
+            out = TxOut(value, scr)
+            inp.witness_utxo = streamed(out)
+
+            # same as fake_txn
+            supply = Tx(2, [TxIn(pack('4Q', 0xdead, 0xbeef, 0, 0), 73)], [out])
+            if full_utxo:
+                inp.utxo = streamed(supply)
+
+            t.txs_in[i] = TxIn(supply.hash(), 0)
+
+        psbt.txn = streamed(t)
+
+    return doit
+
+@pytest.mark.parametrize('num_ins, num_outs', SIZES)
+@pytest.mark.parametrize('shape, full_utxo', [
+    ('p2pkh', True),
+    ('p2sh-p2wpkh', False), ('p2sh-p2wpkh', True),
+    ('p2wpkh', False), ('p2wpkh', True),
+])
+def test_bench_singlesig(shape, full_utxo, num_ins, num_outs, fake_txn, run_bench):
+    if shape == 'p2pkh':
+        psbt = fake_txn(num_ins, num_outs)
+    else:
+        psbt = fake_txn(num_ins, num_outs, segwit_in=True,
+                    psbt_hacker=segwit_hacker(wrapped=(shape != 'p2wpkh'), full_utxo=full_utxo))
+
+    name = '%s%s/%dx%d' % (shape, '+utxo' if full_utxo else '', num_ins, num_outs)
+    run_bench(name, psbt, finalize=True)
+
+@pytest.mark.parametrize('num_ins, num_outs', SIZES)
+@pytest.mark.parametrize('M_N', [(2, 3)])
+def test_bench_multisig(M_N, num_ins, num_outs, clear_ms, import_ms_wallet, fake_ms_txn,
+                            run_bench):
+    # classic p2sh multisig, which always has full UTXO; can't finalize 2-of-3
+    M, N = M_N
+    clear_ms()
+    keys = import_ms_wallet(M, N, name='bench', accept=1)
+
+    psbt = fake_ms_txn(num_ins, num_outs, M, keys)
+
+    run_bench('multisig-%dof%d/%dx%d' % (M, N, num_ins, num_outs), psbt)
+    clear_ms()
+
+@pytest.mark.parametrize('M_N', [(2, 3), (3, 5)])
+@pytest.mark.parametrize('cached', [False, True])
+def test_bench_ms_node_cache(M_N, cached, clear_ms, import_ms_wallet, micro_bench, count=50):
+    # validate_script() w/ and w/o the parsed-xpub node cache
+    M, N = M_N
+    clear_ms()
+    import_ms_wallet(M, N, name='bench', accept=1)
+
+    setup = """
+from multisig import MultisigWallet
+ms = list(MultisigWallet.get_all())[0]
+todo = []
+for idx, _, _, script in ms.yield_addresses(0, %d):
+    sp = {}
+    for xp_idx, (xfp, _, _) in enumerate(ms.xpubs):
+        sp[ms.get_node(xp_idx, (0, idx)).pubkey()] = ms.xfp_paths[xfp] + [0, idx]
+    todo.append((script, sp))
+ms._node_cache.clear()
+""" % count
+    body = """
+for script, sp in todo:
+    %sms.validate_script(script, subpaths=sp)
+""" % ('' if cached else 'ms._node_cache.clear(); ')
+
+    micro_bench('ms-validate-script-%dof%d%s' % (M, N, '' if cached else '-nocache'),
+                        setup, body)
+    clear_ms()
+
+@pytest.mark.parametrize('num_lines', [10, 5000])
+def test_bench_story_pager(num_lines, micro_bench):
+    # time to first screen of a long story
+    setup = """
+import uio
+from ux import StoryPager
+msg = uio.StringIO()
+for i in range(%d):
+    msg.write('Output #%%d: sends some coins to an address which is long\\n\\n' %% i)
+""" % num_lines
+    body = """
+StoryPager(msg, 'Title').window(5)
+"""
+
+    micro_bench('story-first-screen-%d' % num_lines, setup, body, count=10)
+
+@pytest.mark.parametrize('cls', ['SFFile', 'PSRAMFile'])
+@pytest.mark.parametrize('num_ins, num_outs', [(10, 10), (30, 300)])
+def test_bench_psram_parse(cls, num_ins, num_outs, fake_txn, micro_bench, only_mk4):
+    # PSBT parse time: SFFile vs. zero-copy PSRAMFile
+    psbt = fake_txn(num_ins, num_outs, segwit_in=False)
+    fname = 'debug/parse-bench.psbt'
+    open(fname, 'wb').write(psbt)
+
+    setup = """
+from sffile import SFFile, PSRAMFile
+from psbt import psbtObject, calc_txid
+raw = open(%r, 'rb').read()
+with SFFile(0, max_size=len(raw)) as fd:
+    fd.write(raw)
+del raw
+""" % ('../../testing/' + fname)
+    body = """
+with %s(0, length=%d) as fd:
+    p = psbtObject.read_psbt(fd)
+    for _, txi in p.input_iter(): pass
+    for _, txo in p.output_iter(): pass
+    for inp in p.inputs:
+        if inp.utxo: calc_txid(fd, inp.utxo)
+del p
+""" % (cls, len(psbt))
+
+    micro_bench('parse-%s-%dx%d' % (cls, num_ins, num_outs), setup, body)
+
+@pytest.mark.parametrize('num_ins', [10, 250])
+def test_bench_ovc_verify(num_ins, micro_bench, sim_exec):
+    # segwit amount check for whole PSBT: first sight, then again once known
+    setup = """
+import history
+from serializations import COutPoint
+history.OutptValueCache.clear()
+ins = [(COutPoint(0xd00d + i, i %% 3), 1000+i, i) for i in range(%d)]
+""" % num_ins
+
+    micro_bench('ovc-add-%d' % num_ins, setup, 'history.verify_amounts(ins)')
+    micro_bench('ovc-recheck-%d' % num_ins,
+                    setup + 'history.verify_amounts(ins)', 'history.verify_amounts(ins)')
+
+    sim_exec('import history; history.OutptValueCache.clear()')
+
+@pytest.mark.parametrize('size', [0, 1000, 3000])
+def test_bench_settings(size, micro_bench, sim_exec):
+    # settings save/load, for a few sizes of settings
+    setup = """
+from glob import settings
+settings.set('bench', 'x'*%d)
+""" % size
+
+    try:
+        micro_bench('settings-save-%d' % size, setup,
+                            'settings.changed(); settings.save()', count=10)
+        micro_bench('settings-load-%d' % size, setup, 'settings.load()', count=10)
+    finally:
+        sim_exec('from glob import settings; settings.remove_key("bench"); settings.save()')
+
+@pytest.mark.parametrize('pw', ['test', 'word '*24])
+def test_bench_7z_keystretch(pw, micro_bench, rounds_pow=16):
+    # 7z key derivation, as used for encrypted backups
+    setup = """
+import compat7z
+t = compat7z.Builder()
+t.rounds_pow = %d
+""" % rounds_pow
+
+    micro_bench('7z-key-2^%d-%d' % (rounds_pow, len(pw)), setup, 't.calculate_key(%r)' % pw)
+
+def compare(old_fn, new_fn):
+    # show change in each measurement, between two result files
+    old = json.load(open(old_fn))
+    new = json.load(open(new_fn))
+    print('%s (%s) => %s (%s)' % (old_fn, old['git'], new_fn, new['git']))
+
+    cols = PHASES + ['total', 'peak_heap']
+    print('%-32s ' % 'shape' + ' '.join('%10s' % c for c in cols))
+
+    for name in sorted(new['results']):
+        if name not in old['results']:
+            continue
+        a, b = old['results'][name], new['results'][name]
+        print('%-32s ' % name + ' '.join('%+9.1f%%' % ((b[c] - a[c]) * 100.0 / a[c])
+                                            if a[c] else '%10s' % '-' for c in cols))
+
+    print()
+    for name in sorted(new.get('micro', {})):
+        a, b = old.get('micro', {}).get(name), new['micro'][name]
+        if a:
+            print('%-40s %10.1f => %10.1f us  %+9.1f%%' % (name, a, b, (b - a) * 100.0 / a))
+
+if __name__ == '__main__':
+    import sys
+    compare(*sys.argv[1:3])
+
+# EOF
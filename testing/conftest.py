@@ -34,6 +34,9 @@ def pytest_addoption(parser):
     parser.addoption("--ms-danger", action="store_true",
                      default=False, help="Operate with multisig checks off")
 
+    parser.addoption("--sim-args", default="--eff --set nfc=1",
+                     help="simulator arguments, when started per xdist worker")
+
 @pytest.fixture(scope='session')
 def dev(request):
     # a connected Coldcard (via USB) .. or the simulator
@@ -52,6 +55,39 @@ def dev(request):
         return simulator
 
 
+@pytest.fixture(scope='session')
+def sim_instance(request):
+    # under pytest-xdist (ie. "pytest -n 4"), start a headless simulator for this worker
+    # - own USB socket and work directory, see ../unix/sim_instance.py
+    # - otherwise, expects simulator to be already running
+    import subprocess, shutil, signal
+
+    if not XDIST_WORKER:
+        yield None
+        return
+
+    work = os.path.basename(SIM_WORK)
+    shutil.rmtree(SIM_WORK, ignore_errors=True)
+
+    log = open('debug/sim-%s.log' % XDIST_WORKER, 'wt')
+    args = request.config.getoption('--sim-args').split()
+    proc = subprocess.Popen(['python', 'headless.py', '--socket', SIM_PATH, '--work', work] + args,
+                                cwd='../unix', stdout=log, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+
+    # wait for it to be listening
+    for i in range(100):
+        if os.path.exists(SIM_PATH): break
+        assert proc.poll() is None, 'simulator died, see ' + log.name
+        time.sleep(.1)
+    time.sleep(1)
+
+    yield proc
+
+    os.killpg(proc.pid, signal.SIGTERM)
+    proc.wait()
+    log.close()
+
 @pytest.fixture(scope='session')
 def simulator(request):
     # get a connection to simulator (only, never USB dev)
@@ -60,6 +96,8 @@ def simulator(request):
     if not request.config.getoption("--sim") or request.config.getoption("--dev"):
         raise pytest.skip('need simulator for this test, have real device')
 
+    request.getfixturevalue('sim_instance')
+
     try:
         return ColdcardDevice(sn=SIM_PATH)
     except:
@@ -611,8 +649,8 @@ def virtdisk_path(request, is_simulator, only_mk4):
             get_setting = request.getfixturevalue('get_setting')
             if not get_setting('vidsk', False):
                 raise pytest.xfail('virtdisk disabled')
-            assert os.path.isdir('../unix/work/VirtDisk')
-            return '../unix/work/VirtDisk/' + fn
+            assert os.path.isdir(SIM_WORK + '/VirtDisk')
+            return SIM_WORK + '/VirtDisk/' + fn
         elif sys.platform == 'darwin':
 
             if not request.config.getoption("--manual"):
@@ -642,7 +680,7 @@ def microsd_path(simulator):
 
     def doit(fn):
         # could use: ckcc.get_sim_root_dirs() here
-        return '../unix/work/MicroSD/' + fn
+        return SIM_WORK + '/MicroSD/' + fn
 
     return doit
 
@@ -1,7 +1,17 @@
 # (c) Copyright 2020 by Coinkite Inc. This file is covered by license found in COPYING-CC.
 #
 
-SIM_PATH = '/tmp/ckcc-simulator.sock'
+import os
+
+# with pytest-xdist, each worker gets own simulator (see sim_instance fixture)
+XDIST_WORKER = os.environ.get('PYTEST_XDIST_WORKER')
+
+if XDIST_WORKER:
+    SIM_PATH = '/tmp/ckcc-simulator-%s.sock' % XDIST_WORKER
+    SIM_WORK = '../unix/work-%s' % XDIST_WORKER
+else:
+    SIM_PATH = os.environ.get('CKCC_SIM_SOCKET', '/tmp/ckcc-simulator.sock')
+    SIM_WORK = '../unix/' + os.environ.get('CKCC_SIM_WORK', 'work')
 
 # Simulator normally powers up with this 'wallet'
 simulator_fixed_xprv = "tprv8ZgxMBicQKsPeXJHL3vPPgTAEqQ5P2FD9qDeCQT4Cp1EMY5QkwMPWFxHdxHrxZhhcVRJ2m7BNWTz9Xre68y7mX5vCdMJ5qXMUfnrZ2si2X4"
@@ -0,0 +1,91 @@
+# (c) Copyright 2026 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# Benchmark the PSBT signing pipeline, one phase at a time. See testing/bench_sign.py
+#
+# this will run on the simulator
+# - expects main.FILENAME (PSBT, binary) and main.FINALIZE to be set
+# - writes JSON: microseconds per phase, plus heap used above starting point
+#
+import main, gc, utime, uio, ujson
+from sffile import SFFile, PSRAMFile
+from psbt import psbtObject
+from auth import ApproveTransaction
+from version import MAX_TXN_LEN, has_psram
+
+# load PSBT into simulated SPI Flash / PSRAM, like the USB upload would
+with open(main.FILENAME, 'rb') as orig:
+    raw = orig.read()
+psbt_len = len(raw)
+with SFFile(0, max_size=psbt_len) as fd:
+    fd.write(raw)
+del raw
+
+res = dict(psbt_len=psbt_len)
+peak = 0
+
+gc.collect()
+base = gc.mem_alloc()
+
+# parse
+t0 = utime.ticks_us()
+rd_fd = (PSRAMFile if has_psram else SFFile)(0, length=psbt_len)
+obj = psbtObject.read_psbt(rd_fd)
+res['parse'] = utime.ticks_diff(utime.ticks_us(), t0)
+peak = max(peak, gc.mem_alloc() - base)
+
+# validate: same steps as ApproveTransaction.interact()
+gc.collect()
+t0 = utime.ticks_us()
+try:
+    obj.validate().send(None)
+    raise RuntimeError('validate wants UX')     # ie. multisig import
+except StopIteration:
+    pass
+obj.consider_inputs()
+obj.consider_keys()
+obj.consider_outputs()
+obj.consider_dangerous_sighash()
+res['validate'] = utime.ticks_diff(utime.ticks_us(), t0)
+peak = max(peak, gc.mem_alloc() - base)
+
+# approve: everything for the story, except showing it
+gc.collect()
+t0 = utime.ticks_us()
+ux = ApproveTransaction(psbt_len)
+ux.psbt = obj
+msg = uio.StringIO()
+ux.output_summary_text(msg)
+obj.calculate_fee()
+res['approve'] = utime.ticks_diff(utime.ticks_us(), t0)
+peak = max(peak, gc.mem_alloc() - base)
+del msg, ux
+
+# sign
+gc.collect()
+t0 = utime.ticks_us()
+obj.sign_it()
+res['sign'] = utime.ticks_diff(utime.ticks_us(), t0)
+peak = max(peak, gc.mem_alloc() - base)
+
+# serialize (or finalize) into output area; not counting flash erase
+out_fd = SFFile(MAX_TXN_LEN, max_size=MAX_TXN_LEN)
+list(out_fd.erase())
+gc.collect()
+t0 = utime.ticks_us()
+if main.FINALIZE:
+    obj.finalize(out_fd)
+else:
+    obj.serialize(out_fd)
+res['serialize'] = utime.ticks_diff(utime.ticks_us(), t0)
+peak = max(peak, gc.mem_alloc() - base)
+res['out_len'] = out_fd.tell()
+out_fd.close()
+
+# lower bound: GC may run inside a phase
+res['peak_heap'] = peak
+
+rd_fd.close()
+del obj
+gc.collect()
+
+RV.write(ujson.dumps(res))
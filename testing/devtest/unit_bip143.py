@@ -164,3 +164,22 @@ for name, unsigned_tx, scriptCode, idx, outpoint, sighash_type, amount, sighash
     assert digest == a2b_hex(sighash), "%s\nExpected %s\nGot      %s" % (name, sighash, got)
     print(name, "OK")
 
+
+# same txn, all sighash types, from one parsed object: shared hashes are reused
+same = [row for row in BIP143_DATA if row[0].startswith('P2SH-P2WSH')]
+assert len(same) == 6
+unsigned = a2b_hex(same[0][1])
+fd = SFFile(0, max_size=65536)
+list(fd.erase())
+fd.write(b'psbt\xff\x01\x00' + ser_compact_size(len(unsigned)) + unsigned + (b'\0'*8))
+p = psbtObject.read_psbt(SFFile(0, fd.tell()))
+for name, unsigned_tx, scriptCode, idx, outpoint, sighash_type, amount, sighash in same:
+    assert unsigned_tx == same[0][1]
+    replacement = CTxIn()
+    replacement.deserialize(BytesIO(a2b_hex(outpoint)))
+    digest = p.make_txn_segwit_sighash(idx, replacement, unpack("<q", a2b_hex(amount))[0],
+                                            a2b_hex(scriptCode), sighash_type)
+    assert digest == a2b_hex(sighash), name
+assert p.hashPrevouts and p.hashSequence and p.hashOutputs
+assert list(p.hash_single) == [0]
+print("Reuse OK")
@@ -261,6 +261,46 @@ def test_dump_addresses(way, change, generate_addresses_file, mk_common_derivati
         sk = node_prv.subkey_for_path(subpath[2:])
         validate_address(addr, sk)
 
+@pytest.mark.parametrize('start, count', [(0, 300), (5000, 1200)])
+@pytest.mark.parametrize('click_idx', [1, 5])
+def test_bulk_export(start, count, click_idx, goto_address_explorer, need_keypress, cap_story,
+                     load_export_and_verify_signature, sim_execfile, validate_address):
+    # export a larger range, from a start index; derived from public parent node
+    node_prv = BIP32Node.from_wallet_key(
+        sim_execfile('devtest/dump_private.py').strip()
+    )
+    goto_address_explorer(click_idx=click_idx)
+    time.sleep(.3)
+    title, story = cap_story()
+    assert 'Press OK for bulk export.' in story
+    need_keypress('y')
+
+    for num in [start, count]:
+        for d in str(num):
+            need_keypress(d)
+        need_keypress('y')
+        time.sleep(.1)
+
+    title, story = cap_story()
+    assert 'Save addresses %d..%d' % (start, start+count-1) in story
+    need_keypress('1' if '(1)' in story else 'y')
+
+    time.sleep(.5 + count/500)
+    title, body = cap_story()
+    contents, sig_addr = load_export_and_verify_signature(body, 'sd', label="Address summary")
+
+    cc = csv.reader(io.StringIO(contents))
+    assert next(cc) == ['Index', 'Payment Address', 'Derivation']
+    rows = list(cc)
+    assert len(rows) == count
+    assert sig_addr == rows[0][1]
+
+    for n, (idx, addr, deriv) in enumerate(rows):
+        assert int(idx) == start + n
+        assert deriv.endswith('/%d' % (start + n))
+        if n % 97 == 0 or n == count-1:
+            validate_address(addr, node_prv.subkey_for_path(deriv[2:]))
+
 @pytest.mark.parametrize('account_num', [ 34, 100, 9999, 1])
 @pytest.mark.parametrize('way', ["sd", "vdisk", "nfc"])
 def test_account_menu(way, account_num, sim_execfile, pick_menu_item, goto_address_explorer, need_keypress, cap_menu,
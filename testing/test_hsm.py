@@ -642,6 +642,26 @@ def test_whitelist_multi(dev, start_hsm, tweak_rule, attempt_psbt, fake_txn, amo
         assert nwl == dest
         assert nwl in dests
 
+def test_many_rules(dev, start_hsm, tweak_rule, attempt_psbt, fake_txn, num_rules=12, num_out=40):
+    # many rules, each looking at all the outputs of a big txn; only the last matches
+    dests = []
+    psbt = fake_txn(1, num_out, dev.master_xpub, outstyles=['p2wpkh', 'p2pkh'],
+                        capture_scripts=dests)
+    dests = [render_address(s) for s in dests]
+
+    rules = [dict(whitelist=EXAMPLE_ADDRS[0:1+(i % len(EXAMPLE_ADDRS))])
+                    for i in range(num_rules-1)]
+    rules.append(dict(whitelist=dests[1:]))
+    start_hsm(DICT(rules=rules))
+
+    msg = attempt_psbt(psbt, 'non-whitelisted')
+    for n in range(1, num_rules+1):
+        assert ('rule #%d: non-whitelisted' % n) in msg
+    assert msg.endswith(dests[0])
+
+    tweak_rule(num_rules-1, dict(whitelist=dests))
+    attempt_psbt(psbt)
+
 def test_whitelist_invalid_attestation(start_hsm, attempt_psbt, fake_txn):
     from psbt import ser_prop_key
     ID = b"COINKITE"
@@ -751,6 +771,154 @@ def test_big_txn(num_in, num_out, dev, quick_start_hsm, hsm_status, is_simulator
         attempt_psbt(psbt)
 
 
+@pytest.fixture
+def batch_sign(dev):
+    # sign many PSBT using the batch commands: keep all slots busy, and
+    # upload/download while other slots are being signed
+    def upload(slot, data):
+        chunk = MAX_BLK_LEN - 256
+        for pos in range(0, len(data), chunk):
+            here = data[pos:pos+chunk]
+            rb = dev.send_recv(b'bupl' + struct.pack('<BII', slot, pos, len(data)) + here)
+            assert rb == pos
+        return sha256(data).digest()
+
+    def download(slot, ln):
+        rv = b''
+        while len(rv) < ln:
+            rv += dev.send_recv(b'bdwl' + struct.pack('<BII', slot, len(rv), ln-len(rv)))
+        return rv
+
+    def doit(psbts, num_slots=4):
+        results = [None] * len(psbts)
+        pending = {}
+        nxt = 0
+        while (nxt < len(psbts)) or pending:
+            for slot in range(num_slots):
+                if slot in pending or nxt >= len(psbts):
+                    continue
+                sha = upload(slot, psbts[nxt])
+                dev.send_recv(b'bstx' + struct.pack('<BII32s', slot, len(psbts[nxt]), 0, sha))
+                pending[slot] = nxt
+                nxt += 1
+
+            for slot, idx in list(pending.items()):
+                done = dev.send_recv(b'bsok' + bytes([slot]), timeout=None)
+                if done is None:
+                    continue
+                resp_len, chk = done
+                results[idx] = download(slot, resp_len)
+                assert sha256(results[idx]).digest() == chk
+                del pending[slot]
+
+        return results
+
+    return doit
+
+@pytest.mark.parametrize('num_psbt', [12])
+def test_batch_throughput(num_psbt, dev, only_mk4, start_hsm, fake_txn, start_sign,
+                                batch_sign, hsm_status):
+    # pipelined batch signing vs. one-at-a-time
+    start_hsm(DICT(rules=[{}]))
+
+    psbts = [fake_txn(5, 10, dev.master_xpub, segwit_in=bool(i%2)) for i in range(num_psbt)]
+
+    t0 = time.time()
+    serial = []
+    for psbt in psbts:
+        start_sign(psbt)
+        resp_len, chk = wait_til_signed(dev)
+        serial.append(dev.download_file(resp_len, chk))
+    serial_time = time.time() - t0
+
+    t0 = time.time()
+    batched = batch_sign(psbts)
+    batch_time = time.time() - t0
+
+    # signatures are deterministic, so exactly the same result
+    assert batched == serial
+    assert hsm_status().approvals == 2*num_psbt
+
+    print("%d PSBT: one-at-a-time: %.2fs (%.2f/s)  batched: %.2fs (%.2f/s)" % (
+                num_psbt, serial_time, num_psbt/serial_time, batch_time, num_psbt/batch_time))
+
+def test_batch_refused(dev, only_mk4, start_hsm, fake_txn, batch_sign, tweak_rule):
+    # refusal in one slot doesn't affect the others
+    start_hsm(DICT(rules=[dict(max_amount=int(1E8))]))
+
+    psbts = [fake_txn(1+(i%2), 2, dev.master_xpub) for i in range(4)]
+
+    with pytest.raises(CCUserRefused):
+        batch_sign(psbts)
+
+    # in-flight slots finish anyway; collect them
+    for slot in range(4):
+        try:
+            while dev.send_recv(b'bsok' + bytes([slot]), timeout=None) is None:
+                time.sleep(0.050)
+        except (CCUserRefused, CCProtoError):
+            pass
+
+    # only the one-input PSBT fit under limit
+    tweak_rule(0, dict(max_amount=int(3E8)))
+    assert all(batch_sign(psbts))
+
+def test_batch_vs_single(dev, only_mk4, start_hsm, fake_txn, start_sign, batch_sign):
+    # batch slots share PSRAM with upld/stxn: refused until single PSBT is collected
+    from ckcc_protocol.protocol import CCBusyError
+    start_hsm(DICT(rules=[{}]))
+
+    psbt = fake_txn(2, 2, dev.master_xpub)
+    start_sign(psbt)
+    for cmd in [b'bupl' + struct.pack('<BII', 0, 0, len(psbt)) + psbt[:256],
+                b'bstx' + struct.pack('<BII32s', 0, len(psbt), 0, sha256(psbt).digest())]:
+        with pytest.raises(CCBusyError):
+            dev.send_recv(cmd)
+
+    resp_len, chk = wait_til_signed(dev)
+    single = dev.download_file(resp_len, chk)
+
+    # blocks must start at offset zero
+    with pytest.raises(CCProtoError) as ee:
+        dev.send_recv(b'bupl' + struct.pack('<BII', 1, 256, 512) + psbt[256:512])
+    assert 'order' in str(ee)
+
+    assert batch_sign([psbt]) == [single]
+
+def test_batch_background(dev, only_mk4, start_hsm, fake_txn, batch_sign, sim_exec):
+    # batch signing leaves UX alone, and frees slots never collected by host
+    start_hsm(DICT(rules=[{}]))
+
+    ux_stack = 'from ux import the_ux; RV.write(repr([id(u) for u in the_ux.stack]))'
+    before = sim_exec(ux_stack)
+    assert all(batch_sign([fake_txn(2, 2, dev.master_xpub) for i in range(3)]))
+    assert sim_exec(ux_stack) == before
+
+    sim_exec('from auth import BatchSigner; BatchSigner.result_timeout = 0')
+    try:
+        psbt = fake_txn(2, 2, dev.master_xpub)
+        assert len(psbt) < MAX_BLK_LEN
+        dev.send_recv(b'bupl' + struct.pack('<BII', 2, 0, len(psbt)) + psbt)
+        dev.send_recv(b'bstx' + struct.pack('<BII32s', 2, len(psbt), 0,
+                                                sha256(psbt).digest()))
+
+        # wait til signed, but don't collect it
+        done = 'from auth import BatchSigner; RV.write(str(BatchSigner.active.slots[2].ux_done))'
+        for retry in range(100):
+            if sim_exec(done) == 'True':
+                break
+            time.sleep(0.050)
+        else:
+            pytest.fail('never signed')
+
+        with pytest.raises(CCProtoError) as ee:
+            dev.send_recv(b'bsok' + bytes([2]))
+        assert 'No active request' in str(ee)
+    finally:
+        sim_exec('from auth import BatchSigner; BatchSigner.result_timeout = 60000')
+
+    assert sim_exec(ux_stack) == before
+
 def test_sign_msg_good(quick_start_hsm, change_hsm, attempt_msg_sign, addr_fmt=AF_CLASSIC):
     # message signing, but only at certain derivations
     permit = ['m/73', "m/*'", 'm/1p/3h/4/5/6/7' ]
@@ -816,6 +984,60 @@ def test_never_log(dev, start_hsm, attempt_msg_sign, fake_txn, attempt_psbt, sim
     # WEAK test
     attempt_msg_sign(None, b'hello', 'm', addr_fmt=AF_CLASSIC)
 
+def test_audit_record(dev, start_hsm, fake_txn, attempt_psbt, microsd_path, num_out=15):
+    # txn log has compact record per output, rather than the story shown to humans
+    start_hsm(DICT(rules=[{}]))
+
+    scripts = []
+    outvals = [int(1E8 // num_out) - 100 - i for i in range(num_out)]
+    psbt = fake_txn(1, num_out, dev.master_xpub, outvals=outvals, change_outputs=[0],
+                        outstyles=ADDR_STYLES, capture_scripts=scripts)
+    attempt_psbt(psbt)
+
+    fn = microsd_path('psbt/%s.log' % b2a_hex(sha256(psbt).digest()[-8:]).decode())
+    time.sleep(1.5)     # log is buffered
+    log = open(fn, 'rt').read().rsplit('SHA256(PSBT) = ', 1)[1]
+
+    assert 'TXID = ' in log
+    assert ' - to address -' not in log
+    assert '1 ins, %d outs, in=100000000 out=%d foreign=%d ' % (
+                num_out, sum(outvals), sum(outvals[1:])) in log
+
+    for idx, (val, scr) in enumerate(zip(outvals, scripts)):
+        ln = 'out[%d] %d %s' % (idx, val, sha256(scr).hexdigest())
+        if idx == 0:
+            ln += ' change'
+        assert ln + '\n' in log
+
+    assert 'APPROVED: Acceptable by rule #1' in log
+
+@pytest.mark.parametrize('must_log', [False, True])
+def test_audit_buffered(must_log, dev, start_hsm, fake_txn, attempt_psbt, microsd_path,
+                            count=5):
+    # log entries are buffered, but when must_log, written before approval is given
+    start_hsm(DICT(rules=[{}], must_log=must_log))
+
+    fnames = []
+    for i in range(count):
+        psbt = fake_txn(1, 1, dev.master_xpub, fee=10000+i)
+        fn = microsd_path('psbt/%s.log' % b2a_hex(sha256(psbt).digest()[-8:]).decode())
+        if os.path.exists(fn):
+            os.unlink(fn)
+        fnames.append(fn)
+
+        attempt_psbt(psbt)
+
+        if must_log:
+            assert 'APPROVED: ' in open(fn, 'rt').read()
+
+    time.sleep(1.5)
+
+    for fn in fnames:
+        log = open(fn, 'rt').read()
+        assert log.count('SHA256(PSBT) = ') == 1
+        assert 'APPROVED: ' in log
+        assert log.endswith('\n===\n\n')
+
 @pytest.fixture
 def enter_local_code(need_keypress):
     def doit(code):
@@ -2611,4 +2611,95 @@ def test_multisig_descriptor_export(M_N, way, addr_fmt, cmn_pth_from_root, clear
             assert obj["desc"] == bare_desc
     clear_ms()
 
+@pytest.mark.parametrize('M_N', [(2, 3), (3, 5)])
+def test_ms_node_cache(M_N, clear_ms, import_ms_wallet, sim_exec, fake_ms_txn, try_sign, count=20):
+    # validate_script() uses cached xpub nodes; cache is emptied once PSBT is done
+    M, N = M_N
+    clear_ms()
+    keys = import_ms_wallet(M, N, name='cache-test', accept=1)
+
+    cmd = """
+from multisig import MultisigWallet
+ms = list(MultisigWallet.get_all())[0]
+todo = []
+for idx, _, _, script in ms.yield_addresses(0, %d):
+    sp = {}
+    for xp_idx, (xfp, _, _) in enumerate(ms.xpubs):
+        sp[ms.get_node(xp_idx, (0, idx)).pubkey()] = ms.xfp_paths[xfp] + [0, idx]
+    todo.append((script, sp))
+ms._node_cache.clear()
+MultisigWallet.node_hits = MultisigWallet.node_misses = 0
+for script, sp in todo:
+    ms.validate_script(script, subpaths=sp)
+RV.write('%%d %%d' %% (MultisigWallet.node_hits, MultisigWallet.node_misses))
+""" % count
+
+    hits, misses = [int(i) for i in sim_exec(cmd).split()]
+
+    # each xpub decoded once, and its /0 derived once (from cached xpub); after
+    # that, both found in cache for each address
+    assert misses == 2 * N
+    assert hits == N * (1 + 2*(count-1))
+
+    psbt = fake_ms_txn(3, 2, M, keys)
+    try_sign(psbt)
+
+    cmd = """
+from multisig import MultisigWallet
+RV.write(repr([len(ms._node_cache) for ms in MultisigWallet.get_all()]))
+"""
+    assert sim_exec(cmd) == '[0]'
+
+    clear_ms()
+
+def test_ms_registry(clear_ms, import_ms_wallet, sim_exec, num_wallets=6):
+    # saved wallets are deserialized once, and found by lookup
+    clear_ms()
+    for i in range(num_wallets):
+        import_ms_wallet(2, 3+(i%3), name='reg-%d' % i, unique=i+1, accept=1)
+
+    cmd = """
+from multisig import MultisigWallet
+ws = list(MultisigWallet.get_all())
+assert len(ws) == %d
+assert all(a is b for a, b in zip(ws, MultisigWallet.get_all()))
+last = ws[-1]
+assert MultisigWallet.get_by_idx(last.storage_idx) is last
+paths = last.get_xfp_paths()
+x = 0
+for xfp in last.xfp_paths: x ^= xfp
+assert MultisigWallet.quick_check(last.M, last.N, x)
+assert not MultisigWallet.quick_check(last.M, last.N, x ^ 1)
+assert MultisigWallet.find_match(last.M, last.N, paths) is last
+RV.write('ok')
+""" % num_wallets
+
+    assert sim_exec(cmd) == 'ok'
+
+    # registry rebuilt after delete
+    cmd = """
+from multisig import MultisigWallet
+MultisigWallet.get_by_idx(0).delete()
+ws = list(MultisigWallet.get_all())
+RV.write(' '.join('%d:%s' % (w.storage_idx, w.name) for w in ws))
+"""
+    got = sim_exec(cmd).split()
+    assert got == ['%d:reg-%d' % (i, i+1) for i in range(num_wallets-1)]
+
+    # and after list is changed in place (same object), including opts
+    cmd = """
+from glob import settings
+from multisig import MultisigWallet
+from public_constants import AF_P2WSH
+lst = settings.get('multisig')
+lst[0] = ['renamed'] + list(lst[0][1:])
+lst[1][3]['ft'] = AF_P2WSH
+settings.set('multisig', lst)
+MultisigWallet.changed()
+RV.write('%s %d' % (MultisigWallet.get_by_idx(0).name, MultisigWallet.get_by_idx(1).addr_fmt))
+"""
+    assert sim_exec(cmd) == 'renamed %d' % AF_P2WSH
+
+    clear_ms()
+
 # EOF
@@ -405,5 +405,43 @@ def test_ndef_roundtrip(load_shared_mod):
     assert cc_ndef.ccfile_decode(r) == (12, 399, False, 4096)
 
 
+@pytest.mark.parametrize('size', [500, 4000, 7900])
+def test_nfc_write_cost(size, sim_exec, only_mk4):
+    # only rows which change are written to EEPROM; header row goes last
+    body = bytes((i*7) & 0xff for i in range(size))
+
+    def do_write(data):
+        sim_exec('glob.NFC.reset_cost()')
+        rv = sim_exec('list(glob.NFC.big_write(%r)); RV.write(repr(glob.NFC.write_cost))' % data)
+        assert 'Traceback' not in rv, rv
+        return eval(rv)
+
+    def read_back():
+        return sim_exec('RV.write(glob.NFC.read(0, %d))' % size, binary=True)
+
+    sim_exec('list(glob.NFC.wipe(False))')
+    first = do_write(body)
+    assert read_back() == body
+    assert first['rows'] <= (size + 15) // 16
+    assert first['last'] == 0
+    print(f"{size} bytes: first write {first['rows']} rows, ~{first['ms']}ms")
+
+    # same again: nothing to do
+    again = do_write(body)
+    assert again['rows'] == 0
+
+    # one byte in the middle changed: one row
+    edit = bytearray(body)
+    edit[size//2] ^= 0x55
+    one = do_write(bytes(edit))
+    assert one['rows'] == 1
+    assert read_back() == edit
+
+    # wipe only needs to touch rows that hold data
+    sim_exec('glob.NFC.reset_cost()')
+    sim_exec('list(glob.NFC.wipe(False))')
+    wc = eval(sim_exec('RV.write(repr(glob.NFC.write_cost))'))
+    assert wc['rows'] <= 512 // 16
+    assert read_back()[0:512] == bytes(min(size, 512))
 
 # EOF
@@ -14,7 +14,7 @@ from base64 import b64encode, b64decode
 from helpers import B2A, U2SAT, prandom, fake_dest_addr, make_change_addr, parse_change_back
 from helpers import xfp2str
 from pycoin.key.BIP32Node import BIP32Node
-from constants import ADDR_STYLES, ADDR_STYLES_SINGLE, SIGHASH_MAP
+from constants import ADDR_STYLES, ADDR_STYLES_SINGLE, SIGHASH_MAP, SIM_WORK
 from txn import *
 from ckcc_protocol.constants import STXN_FINALIZE, STXN_VISUALIZE, STXN_SIGNED
 
@@ -123,7 +123,7 @@ def test_psbt_proxy_parsing(fn, sim_execfile, sim_exec):
     rv = sim_execfile('devtest/unit_psbt.py')
     assert not rv, rv
 
-    rb = '../unix/work/readback.psbt'
+    rb = SIM_WORK + '/readback.psbt'
 
     oo = BasicPSBT().parse(open(fn, 'rb').read())
     rb = BasicPSBT().parse(open(rb, 'rb').read())
@@ -2010,4 +2010,184 @@ def test_send2taproot_addresss(fake_txn , start_sign, end_sign, cap_story):
     signed = end_sign(accept=True, finalize=False)
     assert signed
 
+@pytest.mark.parametrize('num_ins', [1, 15])
+@pytest.mark.parametrize('segwit', [True, False])
+def test_derive_cache(num_ins, segwit, fake_txn, try_sign, sim_exec):
+    # all inputs are m/0/N: expect one derivation of m/0 and then single steps
+    sim_exec('import stash; stash.SensitiveValues.deriv_hits = 0; '
+                'stash.SensitiveValues.deriv_misses = 0')
+
+    psbt = fake_txn(num_ins, 1, segwit_in=segwit)
+    try_sign(psbt, accept=True)
+
+    hits = int(sim_exec('import stash; RV.write(str(stash.SensitiveValues.deriv_hits))'))
+    misses = int(sim_exec('import stash; RV.write(str(stash.SensitiveValues.deriv_misses))'))
+
+    assert misses == 1
+    assert hits == num_ins - 1
+
+def test_derive_cache_acct(sim_exec):
+    # account level is cached too; cache is bounded, kept out of spots, and wiped on exit
+    cmd = """
+from stash import SensitiveValues, DERIV_CACHE_SIZE
+with SensitiveValues() as sv:
+    ns = len(sv.spots)
+    for p in ["m/84h/0h/0h/0/3", "m/84h/0h/0h/1/3", "m/44h/0h/0h/0/7", "m/0/5"]:
+        a = sv.derive_path(p, register=False)
+        b = sv.derive_path(p, master=sv.node, register=False)
+        assert a.pubkey() == b.pubkey(), p
+    assert len(sv.spots) == ns
+    assert sorted(len(k) for k in sv._deriv_cache) == [1, 3, 3, 4, 4, 4]
+    for i in range(3*DERIV_CACHE_SIZE):
+        sv.derive_path("m/84h/0h/0h/%d/0" % i, register=False)
+    assert len(sv._deriv_cache) == DERIV_CACHE_SIZE
+    assert len(sv.spots) == ns
+    cache = sv._deriv_cache
+RV.write(str(len(cache)))
+"""
+    assert sim_exec(cmd) == '0'
+
+@pytest.mark.parametrize('num_ins', [2, 25])
+def test_shared_funding_txn(num_ins, fake_txn, try_sign):
+    # all inputs spend outputs of the same (non-witness) funding txn
+    from pycoin.tx.Tx import Tx
+    from pycoin.tx.TxIn import TxIn
+
+    parent = Tx(2, [TxIn(struct.pack('4Q', 0xdead, 0xbeef, 0, 0), 73)], [])
+
+    def hack(psbt):
+        for inp in psbt.inputs:
+            parent.txs_out.append(Tx.from_bin(inp.utxo).txs_out[0])
+
+        with BytesIO() as fd:
+            parent.stream(fd)
+            raw = fd.getvalue()
+
+        t = Tx.from_bin(psbt.txn)
+        for i, inp in enumerate(psbt.inputs):
+            inp.utxo = raw
+            t.txs_in[i] = TxIn(parent.hash(), i)
+
+        with BytesIO() as fd:
+            t.stream(fd)
+            psbt.txn = fd.getvalue()
+
+    psbt = fake_txn(num_ins, 1, psbt_hacker=hack)
+    _, txn = try_sign(psbt, accept=True, finalize=True)
+
+    t = Tx.from_bin(txn)
+    assert len(t.txs_in) == num_ins
+    assert all(ti.previous_hash == parent.hash() for ti in t.txs_in)
+    assert [ti.previous_index for ti in t.txs_in] == list(range(num_ins))
+    assert all(ti.script for ti in t.txs_in)
+
+@pytest.mark.parametrize('num_ins, num_outs', [(10, 10), (30, 300)])
+def test_psram_parse(num_ins, num_outs, fake_txn, sim_exec, only_mk4):
+    # zero-copy PSRAMFile must parse exactly as SFFile does
+    psbt = fake_txn(num_ins, num_outs, segwit_in=False)
+    fname = 'debug/parse-psram.psbt'
+    open(fname, 'wb').write(psbt)
+
+    cmd = """
+from sffile import SFFile, PSRAMFile
+from psbt import psbtObject, calc_txid
+from glob import PSRAM
+from ubinascii import hexlify as b2a_hex
+raw = open(%r, 'rb').read()
+with SFFile(0, max_size=len(raw)) as fd:
+    fd.write(raw)
+del raw
+res = []
+for cls in (SFFile, PSRAMFile):
+    got = []
+    with cls(0, length=%d) as fd:
+        p = psbtObject.read_psbt(fd)
+        for _, txi in p.input_iter(): got.append(b2a_hex(txi.serialize()))
+        for _, txo in p.output_iter(): got.append(b2a_hex(txo.serialize()))
+        for inp in p.inputs:
+            if inp.utxo: got.append(b2a_hex(calc_txid(fd, inp.utxo)))
+    del p
+    res.append(got)
+assert res[0] == res[1], 'parse differs'
+
+# view() is a window onto PSRAM itself, not a copy
+with PSRAMFile(0, length=%d) as fd:
+    fd.seek(8)
+    v = fd.view(4)
+    assert isinstance(v, memoryview), type(v)
+    was = bytes(v)
+    PSRAM.write(8, b'\\xa5\\x5a\\xa5\\x5a')
+    assert bytes(v) == b'\\xa5\\x5a\\xa5\\x5a', 'copied'
+    PSRAM.write(8, was)
+    assert bytes(v) == was
+RV.write('%%d' %% len(res[0]))
+""" % ('../../testing/' + fname, len(psbt), len(psbt))
+
+    assert int(sim_exec(cmd)) >= num_ins + num_outs
+
+@pytest.mark.parametrize('segwit_in', [False, True])
+def test_proxy_heap(segwit_in, fake_txn, sim_exec, num_ins=100, num_outs=2000):
+    # benchmark: heap held by parsed PSBT, per input and per (foreign) output
+    def measure(psbt):
+        fname = 'debug/heap-bench.psbt'
+        open(fname, 'wb').write(psbt)
+
+        cmd = """
+import gc
+from sffile import SFFile
+from psbt import psbtObject
+raw = open(%r, 'rb').read()
+with SFFile(0, max_size=len(raw)) as fd:
+    fd.write(raw)
+del raw
+gc.collect()
+a = gc.mem_alloc()
+with SFFile(0, length=%d) as fd:
+    p = psbtObject.read_psbt(fd)
+    gc.collect()
+    RV.write(str(gc.mem_alloc() - a))
+    del p
+""" % ('../../testing/' + fname, len(psbt))
+
+        return int(sim_exec(cmd))
+
+    base = measure(fake_txn(1, 1, segwit_in=segwit_in))
+    per_in = (measure(fake_txn(num_ins, 1, segwit_in=segwit_in)) - base) / (num_ins-1)
+    per_out = (measure(fake_txn(1, num_outs, segwit_in=segwit_in)) - base) / (num_outs-1)
+
+    print("PSBT heap: %.1f bytes per input, %.1f bytes per output" % (per_in, per_out))
+
+    # just a list slot each (plus growth)
+    assert per_out < 16
+
+def test_ovc_bulk_verify(sim_exec, settings_get, num_ins=250):
+    # segwit amounts for whole PSBT checked at once: one settings update
+    cmd = """
+import history
+from glob import settings
+from serializations import COutPoint
+history.OutptValueCache.clear()
+ins = [(COutPoint(0xd00d + i, i % 3), 1000+i, i) for i in range(%d)]
+orig = settings.set
+count = [0]
+def counter(*a):
+    count[0] += 1
+    orig(*a)
+settings.set = counter
+try:
+    history.verify_amounts(ins)
+    history.verify_amounts(ins[-100:])
+finally:
+    settings.set = orig
+RV.write('%%d %%d' %% (count[0], len(history.OutptValueCache.runtime_cache)))
+""" % num_ins
+
+    sets, mem = map(int, sim_exec(cmd).split())
+
+    assert sets == 1
+    assert mem == 128
+    assert len(settings_get('ovc')) == 30
+
+    sim_exec('import history; history.OutptValueCache.clear()')
+
 # EOF
@@ -95,6 +95,91 @@ def test_nvram_mk4(unit_test, only_mk4):
     # exercise nvram simulation: only mk4
     unit_test('devtest/nvram_mk4.py')
 
+@pytest.mark.parametrize('size', [0, 1000, 3000])
+def test_nvram_resave(size, sim_exec):
+    # a save with nothing changed doesn't touch the flash again
+    cmd = '''\
+from glob import settings; was = dict(settings.current)
+settings.set('bench', 'x'*%d)
+settings.save(); settings.load()
+assert settings.get('bench') == 'x'*%d
+age = settings.get('_age'); settings.save(); same = (age == settings.get('_age'))
+settings.current.clear(); settings.current.update(was); settings.changed(); settings.save()
+RV.write('%%d' %% same)''' % (size, size)
+
+    assert sim_exec(cmd) == '1'
+
+@pytest.mark.parametrize('salt, pw, rounds_pow', [
+    (b'', 'test', 19),          # from example-packed.7z
+    (b'abcdef', 'test', 16),
+    (bytes(range(16)), 'word '*24, 13),
+])
+def test_7z_keystretch(salt, pw, rounds_pow, sim_exec):
+    # compare 7z key derivation against simple version
+    from hashlib import sha256
+    from struct import pack
+
+    expect = sha256()
+    upw = pw.encode('utf-16-le')
+    for i in range(1 << rounds_pow):
+        expect.update(salt + upw + pack('<Q', i))
+    expect = expect.digest()
+
+    cmd = 'import compat7z; from ubinascii import hexlify as b2a_hex; ' \
+            't = compat7z.Builder(); t.salt = %r; t.rounds_pow = %d; ' \
+            'RV.write(b2a_hex(t.calculate_key(%r)).decode())' % (salt, rounds_pow, pw)
+
+    got = sim_exec(cmd)
+    assert got == expect.hex()
+
+@pytest.mark.parametrize('num_lines', [10, 500])
+def test_story_pager(num_lines, sim_exec):
+    # lazy story wrapping: every scroll position and page shows same lines as the
+    # old pager, which wrapped whole story up front
+    cmd = """
+import uio
+from ux import StoryPager, CH_PER_W
+from utils import word_wrap
+H = 5
+msg = uio.StringIO()
+for i in range(%d):
+    msg.write('Output #%%d: sends some coins to an address which is long\\n\\n' %% i)
+p = StoryPager(msg, 'Title')
+lines = ['\\x01Title']
+for ln in msg.getvalue().split('\\n'):
+    lines.extend(word_wrap(ln, CH_PER_W) if len(ln) > CH_PER_W else [ln])
+while not lines[-1]: lines.pop()
+lines.append('EOT')
+top = 0
+while 1:
+    assert p.window(H) == lines[top:top+H], top
+    assert len(p.cache) <= 2*H + 2
+    if not p.down(): break
+    top += 1
+assert top == len(lines) - 2
+p.top()
+top = 0
+pages = 0
+while 1:
+    assert p.window(H) == lines[top:top+H], top
+    moved = 0
+    for i in range(H):
+        if not p.down(): break
+        moved += 1
+    if not moved: break
+    top = min(len(lines)-2, top+H)
+    pages += 1
+while p.up(): top -= 1
+assert top == 0
+RV.write('%%d %%d' %% (len(lines), pages))
+""" % num_lines
+
+    num, pages = [int(i) for i in sim_exec(cmd).split()]
+
+    # each output was wrapped, and paging stopped at last line
+    assert num > 3 * num_lines
+    assert pages == (num - 2 + 4) // 5
+
 @pytest.mark.manual
 def test_backups_simple(unit_test, set_seed_words):
     # exercise dump of pub data
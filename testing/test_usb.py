@@ -7,7 +7,9 @@
 import pytest, time, struct
 from pycoin.key.BIP32Node import BIP32Node
 from binascii import b2a_hex, a2b_hex
+from hashlib import sha256
 from ckcc_protocol.protocol import MAX_MSG_LEN, CCProtocolPacker, CCProtoError
+from ckcc_protocol.constants import MAX_BLK_LEN
 
 @pytest.mark.skip
 def test_usb_fuzz(dev):
@@ -219,4 +221,116 @@ def test_remote_up_download(f_len, dev, mk_num):
     rb = dev.download_file(ll, sha, file_number=0)
     assert rb == data
 
+def ll_send(dev, msg):
+    # frame a (not encrypted) request; doesn't wait for response
+    for pos in range(0, len(msg), 63):
+        here = msg[pos:pos+63]
+        flag = len(here) | (0x80 if pos+63 >= len(msg) else 0)
+        dev.dev.write(bytes([flag]) + here + bytes(63-len(here)))
+
+def ll_recv(dev, timeout=3000):
+    # read one (not encrypted) response
+    resp = b''
+    while 1:
+        buf = dev.dev.read(64, timeout_ms=timeout)
+        assert buf, 'timeout'
+        resp += bytes(buf[1:1+(buf[0] & 0x3f)])
+        if buf[0] & 0x80:
+            return resp
+
+def bulk_upload(dev, data):
+    # stream all blocks, then one reply: checksum
+    for pos in range(0, len(data), MAX_BLK_LEN):
+        here = data[pos:pos+MAX_BLK_LEN]
+        ll_send(dev, b'blku' + struct.pack('<II', pos, len(data)) + here)
+
+    resp = ll_recv(dev)
+    assert resp[0:4] == b'biny', resp
+    return resp[4:]
+
+def bulk_download(dev, length, file_number=0):
+    # one request, then many replies; checksum at end
+    ll_send(dev, b'blkd' + struct.pack('<III', 0, length, file_number))
+
+    rv = b''
+    while len(rv) < length:
+        resp = ll_recv(dev)
+        assert resp[0:4] == b'biny', resp
+        rv += resp[4:]
+
+    return rv, dev.send_recv(CCProtocolPacker.sha256())
+
+@pytest.mark.parametrize('f_len', [64*1024, 384*1024])
+def test_bulk_speed(f_len, dev, is_simulator):
+    # compare normal and bulk transfers, in bytes per second
+    if not is_simulator():
+        raise pytest.skip('sim only')
+
+    import os
+    data = os.urandom(f_len)
+    expect = sha256(data).digest()
+
+    t0 = time.time()
+    ll, sha = dev.upload_file(data)
+    up_time = time.time() - t0
+    assert sha == expect
+
+    t0 = time.time()
+    rb = dev.download_file(ll, sha, file_number=0)
+    down_time = time.time() - t0
+    assert rb == data
+
+    t0 = time.time()
+    assert bulk_upload(dev, data) == expect
+    bulk_up_time = time.time() - t0
+
+    t0 = time.time()
+    rb, chk = bulk_download(dev, f_len)
+    bulk_down_time = time.time() - t0
+    assert rb == data
+    assert chk == expect
+
+    print("%d bytes: upload %.0f => %.0f B/s, download %.0f => %.0f B/s" % (f_len,
+            f_len/up_time, f_len/bulk_up_time, f_len/down_time, f_len/bulk_down_time))
+
+@pytest.mark.parametrize('f_len', [64*1024, 384*1024])
+def test_framing_stats(f_len, dev, sim_exec, is_simulator):
+    # USB packet counters, and heap used by framing (per packet) during up/download
+    if not is_simulator():
+        raise pytest.skip('sim only')
+
+    import os
+    data = os.urandom(f_len)
+
+    sim_exec('import usb; usb.handler.stats(reset=True)')
+
+    ll, sha = dev.upload_file(data)
+    assert dev.download_file(ll, sha, file_number=0) == data
+
+    st = eval(sim_exec('import usb; RV.write(repr(usb.handler.stats()))'))
+    pkts = st['rx_packets'] + st['tx_packets']
+
+    print("%d bytes: %d rx, %d tx packets; %.0f rx/s, %.0f tx/s; %.1f heap bytes/packet" % (
+            f_len, st['rx_packets'], st['tx_packets'], st['rx_rate'], st['tx_rate'],
+            st['framing_heap'] / pkts))
+
+    assert st['rx_packets'] >= f_len // 63
+    assert st['tx_packets'] >= f_len // 63
+    assert st['framing_heap'] / pkts < 64
+
+def test_bulk_upload_error(dev, is_simulator):
+    # problems part way thru are reported at end
+    if not is_simulator():
+        raise pytest.skip('sim only')
+
+    ll_send(dev, b'blku' + struct.pack('<II', 0, 10000) + bytes(2048))
+    ll_send(dev, b'blku' + struct.pack('<II', 2000, 10000) + bytes(2048))
+    ll_send(dev, b'blku' + struct.pack('<II', 4096, 4096+100) + bytes(100))
+
+    resp = ll_recv(dev)
+    assert resp == b'err_alignment'
+
+    # next bulk upload is fine
+    assert bulk_upload(dev, b'hello') == sha256(b'hello').digest()
+
 # EOF
@@ -966,7 +966,7 @@ def test_sign_file_from_list_files(f_len, goto_home, cap_story, pick_menu_item,
 
 @pytest.mark.onetime
 def test_dump_menutree(sim_execfile):
-    # saves to ../unix/work/menudump.txt
+    # saves to menudump.txt in simulator work dir (../unix/work)
     sim_execfile('devtest/menu_dump.py')
 
 if 0:
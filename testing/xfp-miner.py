@@ -2,59 +2,240 @@
 #
 # (c) Copyright 2020 by Coinkite Inc. This file is covered by license found in COPYING-CC.
 #
-# Search for an XFP collision. Needs to be much faster.
+# Search for an XFP collision: a master key with same fingerprint as one of the targets.
 #
-import os, hmac, hashlib
-from pycoin.key.BIP32Node import BIP32Node
-from pycoin.encoding import from_bytes_32, to_bytes_32
-from pycoin.serialize import b2h_rev, h2b_rev
-from pycoin.encoding import public_pair_to_hash160_sec
-from binascii import b2a_hex, a2b_hex
-from pycoin import ecdsa
-
-def search(target_xfp):
-    k = BIP32Node.from_hwif("tprv8ZgxMBicQKsPeXJHL3vPPgTAEqQ5P2FD9qDeCQT4Cp1EMY5QkwMPWFxHdxHrxZhhcVRJ2m7BNWTz9Xre68y7mX5vCdMJ5qXMUfnrZ2si2X4")
-
-    pid = os.getpid()
-    target_xfp = h2b_rev(target_xfp)
-
-    # test by going -33 here.
-    #sec_exp = k._secret_exponent - 33
-    sec_exp = k._secret_exponent + (pid * int(1e40))
-    
-    i = 0
-    last_xfp = None
-    while 1:
-        i += 1
-        sec_exp += 1
-
-        public_pair = ecdsa.public_pair_for_secret_exponent(ecdsa.generator_secp256k1, sec_exp)
-
-        xfp = public_pair_to_hash160_sec(public_pair, compressed=True)[:4]
-
-        if i <= 5:
-            # checking code (slow)
-            b = BIP32Node(netcode='BTC', chain_code=bytes(32), secret_exponent=sec_exp)
-            chk = b.fingerprint()
-            assert b._secret_exponent == sec_exp
-            assert xfp == chk, (xfp,chk)
-
-        assert xfp != last_xfp, 'repeat xfp!'
-        last_xfp = xfp
-
-        if xfp == target_xfp:
-            print(f"\n\nFOUND: sec_exp = {sec_exp}\n")
-            b = BIP32Node(netcode='BTC', chain_code=bytes(32), secret_exponent=sec_exp)
-            chk = b.fingerprint()
-            assert b._secret_exponent == sec_exp
-            assert xfp == chk, (xfp,chk)
-            print(b.hwif(), end='\n\n')
-            return
-
-        if not (i % 27):
-            print('  %6d %9d' % (pid, i), end='\r')
+#   ./xfp-miner.py 4369050f [more xfp...]
+#
+# - each candidate is the previous public point plus G: one point addition, and
+#   one modular inverse shared by whole batch (Montgomery's trick)
+# - key space is split into chunks, which are shared over a process pool
+# - progress is saved to a checkpoint file; run the same command again to resume
+#
+import os, sys, time, json, hashlib, argparse
+from multiprocessing import Pool, cpu_count
+
+# secp256k1
+FP = 2**256 - 2**32 - 977
+ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+     0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+
+# starting point of search, and the original test key
+START_KEY = "tprv8ZgxMBicQKsPeXJHL3vPPgTAEqQ5P2FD9qDeCQT4Cp1EMY5QkwMPWFxHdxHrxZhhcVRJ2m7BNWTz9Xre68y7mX5vCdMJ5qXMUfnrZ2si2X4"
+
+BATCH = 2048
+CHECKPOINT = 'debug/xfp-miner.json'
+
+def point_add(a, b):
+    # affine addition, including doubling; None is point at infinity
+    if a is None: return b
+    if b is None: return a
+    if a[0] == b[0]:
+        if (a[1] + b[1]) % FP == 0:
+            return None
+        lam = 3 * a[0] * a[0] * pow(2 * a[1], -1, FP) % FP
+    else:
+        lam = (b[1] - a[1]) * pow(b[0] - a[0], -1, FP) % FP
+    x = (lam * lam - a[0] - b[0]) % FP
+    return (x, (lam * (a[0] - x) - a[1]) % FP)
+
+def point_mul(k):
+    # k * G, only done once per chunk
+    rv = None
+    pt = G
+    while k:
+        if k & 1:
+            rv = point_add(rv, pt)
+        pt = point_add(pt, pt)
+        k >>= 1
+    return rv
+
+def batch_inverse(vals):
+    # modular inverse of each value, for the price of one inverse
+    acc = [0] * len(vals)
+    a = 1
+    for i, v in enumerate(vals):
+        acc[i] = a
+        a = a * v % FP
+    inv = pow(a, -1, FP)
+    rv = [0] * len(vals)
+    for i in range(len(vals)-1, -1, -1):
+        rv[i] = acc[i] * inv % FP
+        inv = inv * vals[i] % FP
+    return rv
+
+try:
+    hashlib.new('ripemd160')
+
+    def hash160(b):
+        return hashlib.new('ripemd160', hashlib.sha256(b).digest()).digest()
+except ValueError:
+    # OpenSSL 3 without legacy provider: slower, but works
+    from pycoin.encoding import hash160
+
+def xfp_of(pt):
+    # first 4 bytes of hash160 of compressed pubkey (same byte order as in PSBT)
+    sec = bytes([2 + (pt[1] & 1)]) + pt[0].to_bytes(32, 'big')
+    return hash160(sec)[:4]
+
+# multiples of G: 1G .. BATCH*G; built once per worker process
+_MULTS = None
+
+def search_chunk(args):
+    # try secret exponents: start .. start+count-1
+    # - returns list of (sec_exp, xfp) that match, and the chunk number
+    global _MULTS
+    chunk_no, start, count, targets = args
+
+    if _MULTS is None:
+        _MULTS = [G]
+        for i in range(BATCH-1):
+            _MULTS.append(point_add(_MULTS[-1], G))
+
+    found = []
+    base = point_mul(start)
+    done = 0
+    while done < count:
+        n = min(BATCH, count - done)
+
+        # candidates: base + j*G for j=0..n-1; also the next base
+        bx, by = base
+        invs = batch_inverse([_MULTS[j][0] - bx for j in range(n)])
+        pts = [base]
+        for j in range(n):
+            mx, my = _MULTS[j]
+            lam = (my - by) * invs[j] % FP
+            x = (lam * lam - bx - mx) % FP
+            pts.append((x, (lam * (bx - x) - by) % FP))
+        base = pts.pop()
+
+        # hash this batch
+        for j, pt in enumerate(pts):
+            xfp = xfp_of(pt)
+            if xfp in targets:
+                found.append((start + done + j, xfp))
+
+        done += n
+
+    return chunk_no, found
+
+def verify(sec_exp, xfp):
+    # slow, but independent check using pycoin
+    from pycoin.key.BIP32Node import BIP32Node
+
+    b = BIP32Node(netcode='BTC', chain_code=bytes(32), secret_exponent=sec_exp)
+    assert b._secret_exponent == sec_exp
+    assert b.fingerprint() == xfp, (b.fingerprint(), xfp)
+    return b
+
+def self_test(start):
+    # our math must agree with pycoin for first few, and batch edges
+    for k in [start, start+1, start+BATCH-1, start+BATCH, start+BATCH+1]:
+        xfp = xfp_of(point_mul(k))
+        verify(k, xfp)
+
+        chunk_no, found = search_chunk((0, k, 1, {xfp}))
+        assert found == [(k, xfp)], found
+
+    # across a batch boundary
+    k = start + BATCH - 3
+    want = xfp_of(point_mul(k + 5))
+    _, found = search_chunk((0, k, 10, {want}))
+    assert (k+5, want) in found, found
+
+def load_checkpoint(fname, params):
+    # chunks done so far: all below 'next', plus those listed in 'done'
+    try:
+        with open(fname, 'rt') as fd:
+            ck = json.load(fd)
+    except FileNotFoundError:
+        return dict(params, next=0, done=[], tried=0, found=[], elapsed=0)
+
+    for k, v in params.items():
+        if ck.get(k) != v:
+            raise SystemExit("Checkpoint %s is for different search (%s); remove it to start over"
+                                % (fname, k))
+    print("Resuming: %d chunks done, %d keys tried, %d found" % (
+                ck['next'] + len(ck['done']), ck['tried'], len(ck['found'])))
+    return ck
+
+def save_checkpoint(fname, ck):
+    tmp = fname + '.tmp'
+    with open(tmp, 'wt') as fd:
+        json.dump(ck, fd, indent=1)
+    os.replace(tmp, fname)
+
+def main():
+    from pycoin.key.BIP32Node import BIP32Node
+
+    ap = argparse.ArgumentParser(description="Search for XFP collisions")
+    ap.add_argument('targets', nargs='+', help="XFP values, in hex (as shown by Coldcard)")
+    ap.add_argument('-j', '--procs', type=int, default=cpu_count(), help="worker processes")
+    ap.add_argument('-c', '--chunk', type=int, default=1<<18, help="keys per chunk of work")
+    ap.add_argument('-k', '--checkpoint', default=CHECKPOINT, help="checkpoint file")
+    ap.add_argument('--keep-going', action='store_true', help="continue after all found")
+    args = ap.parse_args()
+
+    # same byte order as old version: XFP is shown as little-endian number
+    targets = sorted(bytes(reversed(bytes.fromhex(t))).hex() for t in args.targets)
+    start = BIP32Node.from_hwif(START_KEY)._secret_exponent
+
+    self_test(start)
+
+    ck = load_checkpoint(args.checkpoint,
+                            dict(targets=targets, start=start, chunk=args.chunk))
+
+    remain = set(bytes.fromhex(t) for t in targets) \
+                    - set(bytes.fromhex(x) for _, x in ck['found'])
+    done = set(ck['done'])
+    t0 = time.time() - ck['elapsed']
+    t_run = time.time()
+    tried_run = 0
+
+    def chunks():
+        # chunk numbers not yet done, lowest first
+        n = ck['next']
+        while 1:
+            if n not in done:
+                yield n
+            n += 1
+
+    todo = chunks()
+
+    with Pool(args.procs) as pool:
+        while remain or args.keep_going:
+            work = [(n, start + n*args.chunk, args.chunk, remain)
+                        for _, n in zip(range(args.procs * 4), todo)]
+
+            for chunk_no, found in pool.imap_unordered(search_chunk, work):
+                done.add(chunk_no)
+                ck['tried'] += args.chunk
+                tried_run += args.chunk
+
+                for sec_exp, xfp in found:
+                    b = verify(sec_exp, xfp)
+                    print("\n\nFOUND: xfp = %s  sec_exp = %d\n" % (bytes(reversed(xfp)).hex(), sec_exp))
+                    print(b.hwif(), end='\n\n')
+                    ck['found'].append((sec_exp, xfp.hex()))
+                    remain.discard(xfp)
+
+            # lowest chunk not yet done
+            while ck['next'] in done:
+                done.remove(ck['next'])
+                ck['next'] += 1
+            ck['done'] = sorted(done)
+            ck['elapsed'] = time.time() - t0
+            save_checkpoint(args.checkpoint, ck)
+
+            rate = tried_run / (time.time() - t_run)
+            if remain:
+                eta = (2**32 / len(remain)) / rate
+            print('  %12d keys tried, %8.0f keys/sec, %d procs, ~%.1f hours per hit (expected)'
+                    % (ck['tried'], rate, args.procs, eta / 3600 if remain else 0), end='\r')
+
+    print()
 
 if __name__ == '__main__':
-    search('4369050f')
+    main()
 
 # EOF
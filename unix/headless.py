@@ -12,15 +12,19 @@
 #
 import os, sys, tty, pty, termios, time, pdb
 import subprocess
+import sim_instance
 
 def start():
     print("\nColdcard Simulator (headless). Output below is from the simulated system:\n\n")
 
     # capture exec path and move into intended working directory
-    mpy_exec = os.path.realpath('l-port/coldcard-mpy')
+    mpy_exec = os.path.realpath('coldcard-mpy')
+    boot_py = os.path.realpath('sim_boot.py')
     env = os.environ.copy()
     env['MICROPYPATH'] = ':' + os.path.realpath('../shared')
 
+    sock_path, work_dir = sim_instance.setup(env)
+
     # placeholders for all UI objects
     oled_w = os.open('/dev/null', os.O_RDWR)
     led_w = os.open('/dev/null', os.O_RDWR)
@@ -28,17 +32,17 @@ def start():
     # manage unix socket cleanup for client
     def cleanup():
         try:
-            os.unlink('/tmp/ckcc-simulator.sock')
+            os.unlink(sock_path)
         except: pass
 
     cleanup()
     import atexit
     atexit.register(cleanup)
 
-    os.chdir('./work')
-    cc_cmd = ['../coldcard-mpy',
+    os.chdir(work_dir)
+    cc_cmd = [mpy_exec,
                         '-X', 'heapsize=9m',
-                        '-i', '../sim_boot.py',
+                        '-i', boot_py,
                         str(oled_w), '-1', str(led_w)] \
                         + sys.argv[1:]
 
@@ -0,0 +1,39 @@
+# (c) Copyright 2026 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# Where one simulator instance keeps its state: the USB socket, and a working
+# directory (holds MicroSD, VirtDisk and settings). Give each simulator its own
+# to run several at once.
+#
+# - command line: --socket /tmp/ckcc-sim-2.sock --work work-2
+# - or environment: CKCC_SIM_SOCKET and CKCC_SIM_WORK
+# - work directory is relative to this directory, and created if needed; keep
+#   it at same depth as ./work, because test cases use '../../testing/...' from there
+#
+import os, sys
+
+DEFAULT_SOCKET = '/tmp/ckcc-simulator.sock'
+DEFAULT_WORK = 'work'
+
+WORK_SUBDIRS = ['MicroSD', 'VirtDisk', 'settings']
+
+def pop_arg(flag):
+    # remove flag and its value from command line
+    if flag not in sys.argv:
+        return None
+    pos = sys.argv.index(flag)
+    sys.argv.pop(pos)
+    return sys.argv.pop(pos)
+
+def setup(env):
+    # returns socket path and work directory; child learns socket path via env
+    sock = pop_arg('--socket') or os.environ.get('CKCC_SIM_SOCKET') or DEFAULT_SOCKET
+    work = pop_arg('--work') or os.environ.get('CKCC_SIM_WORK') or DEFAULT_WORK
+
+    for d in WORK_SUBDIRS:
+        os.makedirs(os.path.join(work, d), exist_ok=True)
+
+    env['CKCC_SIM_SOCKET'] = sock
+
+    return sock, work
+
+# EOF
@@ -12,18 +12,18 @@
 # Limitations:
 # - USB light not fully implemented, because happens at irq level on real product
 #
-import os, sys, tty, pty, termios, time, pdb, tempfile
+import os, sys, tty, pty, termios, time, pdb
 import subprocess
 import sdl2.ext
+import numpy as np
 from PIL import Image
 from select import select
 import fcntl
 from binascii import b2a_hex, a2b_hex
+import sim_instance
 
 MPY_UNIX = 'l-port/micropython'
 
-UNIX_SOCKET_PATH = '/tmp/ckcc-simulator.sock'
-
 # top-left coord of OLED area; size is 1:1 with real pixels... 128x64 pixels
 OLED_ACTIVE = (46, 85)
 
@@ -47,31 +47,38 @@ class OLEDSimulator:
         self.bg = sdl2.ext.prepare_color('#111', s)
         sdl2.ext.fill(s, self.bg)
 
-        self.mv = sdl2.ext.PixelView(self.sprite)
+        # numpy view onto the surface: indexed [x][y]
+        self.px = sdl2.ext.pixels2d(self.sprite)
+
+        # most recent frame buffer, as sent by SSD1306 driver
+        self.last_buf = bytes(1024)
+
+    @staticmethod
+    def unpack(buf):
+        # SSD1306 layout: 8 pages of 128 columns, each byte is 8 pixels (LSB on top)
+        # - returns array of 0/1 indexed [y][x]
+        pages = np.frombuffer(buf, dtype=np.uint8).reshape(8, 1, 128)
+        return np.unpackbits(pages, axis=1, bitorder='little').reshape(64, 128)
 
     def render(self, window, buf):
         # do a full-screen update of the OLED contents and display
         assert len(buf) == 1024, len(buf)
 
-        for y in range(0, 64, 8):
-            line = buf[y*128//8:]
-            for x in range(128):
-                val = buf[(y*128//8) + x]
-                mask = 0x01
-                for i in range(8):
-                    self.mv[y+i][x] = self.fg if (val & mask) else self.bg
-                    mask <<= 1
+        self.last_buf = bytes(buf)
+        self.px[:] = np.where(self.unpack(buf), self.fg, self.bg).T
 
         if self.movie is not None:
             self.new_frame()
 
+    def frame_image(self, buf):
+        # PIL image, in our two colours, of a frame buffer
+        img = Image.fromarray(self.unpack(buf))
+        img.putpalette([0x11, 0x11, 0x11,  0xcc, 0xcc, 0xff])
+        return img
+
     def snapshot(self):
         fn = time.strftime('../snapshot-%j-%H%M%S.png')
-        with tempfile.NamedTemporaryFile() as tmp:
-            sdl2.SDL_SaveBMP(self.sprite.surface, tmp.name.encode('ascii'))
-            tmp.file.seek(0)
-            img = Image.open(tmp.file)
-            img.save(fn)
+        self.frame_image(self.last_buf).save(fn)
 
         print("Snapshot saved: %s" % fn.split('/', 1)[1])
 
@@ -83,13 +90,13 @@ class OLEDSimulator:
 
     def movie_end(self):
         fn = time.strftime('../movie-%j-%H%M%S.gif')
-        from PIL import Image, ImageSequence
 
         if not self.movie: return
 
-        dt0, img = self.movie[0]
+        # convert to images only now, keep recording cheap
+        frames = [self.frame_image(buf) for _, buf in self.movie]
 
-        img.save(fn, save_all=True, append_images=[fr for _,fr in self.movie[1:]],
+        frames[0].save(fn, save_all=True, append_images=frames[1:],
                         duration=[max(dt, 20) for dt,_ in self.movie], loop=50)
 
         print("Movie saved: %s (%d frames)" % (fn.split('/', 1)[1], len(self.movie)))
@@ -97,17 +104,11 @@ class OLEDSimulator:
         self.movie = None
 
     def new_frame(self):
-        from PIL import Image
-
+        # just the raw frame buffer (1k) and time since previous
         dt = int((time.time() - self.last_frame) * 1000)
         self.last_frame = time.time()
 
-        with tempfile.NamedTemporaryFile() as tmp:
-            sdl2.SDL_SaveBMP(self.sprite.surface, tmp.name.encode('ascii'))
-            tmp.file.seek(0)
-            img = Image.open(tmp.file)
-            img = img.convert('P')
-            self.movie.append((dt, img))
+        self.movie.append((dt, self.last_buf))
 
 class BareMetal:
     #
@@ -331,6 +332,10 @@ def start():
     env = os.environ.copy()
     env['MICROPYPATH'] = ':' + os.path.realpath('../shared')
 
+    sock_path, work_dir = sim_instance.setup(env)
+    mpy_exec = os.path.realpath('coldcard-mpy')
+    boot_py = os.path.realpath('sim_boot.py')
+
     oled_r, oled_w = os.pipe()      # fancy OLED display
     led_r, led_w = os.pipe()        # genuine LED
     numpad_r, numpad_w = os.pipe()  # keys
@@ -338,7 +343,7 @@ def start():
     # manage unix socket cleanup for client
     def sock_cleanup():
         import os
-        fp = UNIX_SOCKET_PATH
+        fp = sock_path
         if os.path.exists(fp):
             os.remove(fp)
     sock_cleanup()
@@ -365,10 +370,10 @@ def start():
         metal_args = []
         bare_metal = None
 
-    os.chdir('./work')
-    cc_cmd = ['../coldcard-mpy', 
+    os.chdir(work_dir)
+    cc_cmd = [mpy_exec,
                         '-X', 'heapsize=9m',
-                        '-i', '../sim_boot.py',
+                        '-i', boot_py,
                         str(oled_w), str(numpad_r), str(led_w)] \
                         + metal_args + sys.argv[1:]
     xterm = subprocess.Popen(['xterm', '-title', 'Coldcard Simulator REPL',
@@ -1,6 +1,19 @@
 # slow replacement for ARM assembly code module
 import ngu
 
-def new(key, nonce=None):
-    return ngu.aes.CTR(key, nonce or bytes(16))
+class _CTR:
+    # adds cipher_inplace(), which the C module has; not really in-place here
+    def __init__(self, ctr):
+        self.ctr = ctr
+
+    def cipher_inplace(self, buf):
+        buf[:] = self.ctr.cipher(buf)
+
+    def copy(self):
+        return _CTR(self.ctr.copy())
 
+    def __getattr__(self, nm):
+        return getattr(self.ctr, nm)
+
+def new(key, nonce=None):
+    return _CTR(ngu.aes.CTR(key, nonce or bytes(16)))
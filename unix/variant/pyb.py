@@ -1,6 +1,6 @@
 import utime as time
 import uerrno as errno
-import sys
+import sys, os
 
 class USB_VCP:
     @staticmethod
@@ -24,7 +24,8 @@ def usb_mode(nm=UNSET, **kws):
     return _umode
 
 class USB_HID:
-    fn = b'/tmp/ckcc-simulator.sock'
+    # set by simulator.py/headless.py; see sim_instance.py
+    fn = (os.getenv('CKCC_SIM_SOCKET') or '/tmp/ckcc-simulator.sock').encode()
 
     def __init__(self):
         self.pipe = None
@@ -96,6 +97,9 @@ class USB_HID:
             if exc.args[0] == errno.ENOENT:
                 # caller is gone
                 return None
+            if exc.args[0] == errno.EAGAIN:
+                # caller hasn't read enough yet (bulk download); like a full endpoint
+                return 0
 
     def _test(self):
         b = bytearray(64)
@@ -7,32 +7,51 @@ TAG_DATA = bytearray(8196)
 # unix/working/nfc-dump.ndef
 DATA_FILE = 'nfc-dump.ndef'
 
+# (ms) time to program one 16-byte row of EEPROM, per datasheet
+ROW_WRITE_MS = 5.5
+
 class SimulatedNFCHandler(NFCHandler):
     def __init__(self):
         self.rf_on = False
         self.i2c = NotImplementedError
         self.uid = bytes(range(8))
         self.mem_size = len(TAG_DATA)
+        self.reset_cost()
+
+    def reset_cost(self):
+        # what writing into EEPROM would have cost on real part
+        # - last: offset of most recent write
+        self.write_cost = dict(writes=0, bytes=0, rows=0, ms=0, last=None)
 
     # flash memory access (fixed tag data): 0x0 to 0x2000
     def read(self, offset, count):
         return bytes(TAG_DATA[offset:offset+count])
 
     def write(self, offset, data):
+        wc = self.write_cost
+        rows = (offset + len(data) + 15) // 16 - (offset // 16)
+        wc['writes'] += 1
+        wc['bytes'] += len(data)
+        wc['rows'] += rows
+        wc['ms'] += rows * ROW_WRITE_MS
+        wc['last'] = offset
+
         TAG_DATA[offset:offset+len(data)] = data
 
     async def big_write(self, data):
         import os
-        self.write(0, data)
+        before = self.write_cost['rows']
+        await super().big_write(data)
         #n = open('nfc-dump.ndef', 'wb').write(self.dump_ndef())
         with open(DATA_FILE, 'wb') as ff:
             n = ff.write(data)
         atime, mtime, ctime = os.stat(DATA_FILE)[-3:]
         self._mtime = mtime
         self._atime = atime
-        print("%d bytes of NDEF written to work/nfc-dump.ndef .. Press N or touch or read that file to simulate taps" % n)
+        print("%d bytes of NDEF written to work/nfc-dump.ndef (%d rows changed) .. Press N or touch or read that file to simulate taps" % (n, self.write_cost['rows'] - before))
 
     async def wipe(self, full_wipe):
+        await super().wipe(full_wipe)
         print("NFC chip wiped (full=%d)" % int(full_wipe))
 
     def is_rf_disabled(self):